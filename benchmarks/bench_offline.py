@@ -0,0 +1,335 @@
+"""Benchmark the plugins' lookups end to end, against a local stand-in wiki.
+
+A local HTTP server answers ``api.php`` and ``index.php`` requests from the
+recorded responses in ``benchmarks/fixtures``, after a configurable delay,
+and the shared client is pointed at it instead of the real Wikimedia hosts.
+Each operation is then run through the fetch engine from several threads at
+once, the way the plugins call it, going through the real client, cache,
+parsers and extractors.
+
+Usage::
+
+    $ python benchmarks/bench_offline.py [--latency MS] [--jitter MS]
+          [--concurrency N] [--requests N] [--distinct N]
+          [--max-concurrency N] [--max-host-concurrency N]
+          [--wiktionary-backend {index,parse}] [operation ...]
+
+Operations are ``mw_snippet``, ``mw_search``, ``mw_search_snippet``,
+``mw_section``, ``mw_image_description`` and ``wikt``; all of them run by
+default. By default every request asks for a different title, so that nothing
+is served from the cache; use ``--distinct`` to repeat titles and measure
+cache hits instead.
+
+For each operation, throughput, p50/p99 latency, the number of requests that
+reached the server and the growth of the process's peak memory are reported.
+"""
+
+from __future__ import annotations
+
+import argparse
+import concurrent.futures
+import html
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Tuple
+from urllib.parse import parse_qs, quote, urlsplit, urlunsplit
+
+from requests.adapters import HTTPAdapter
+
+from sopel_wikimedia import cache, client, engine
+from sopel_wikimedia.wiktionary import impl
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None  # type: ignore[assignment]
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(HERE, "fixtures")
+CORPUS = os.path.join(HERE, "corpus")
+PLACEHOLDER = "__TITLE__"
+
+WIKIPEDIA = "en.wikipedia.org"
+SECTION = "History"
+TEXT_BUDGET = 512
+"""Same budget the wikipedia plugin extracts sections and descriptions with."""
+
+
+def load_fixture(name: str, directory: str = FIXTURES) -> str:
+    with open(os.path.join(directory, name), encoding="utf-8") as fixture:
+        return fixture.read()
+
+
+class Fixtures:
+    """Recorded responses, with the requested title filled in."""
+
+    def __init__(self):
+        self.search = load_fixture("search.json")
+        self.extract = load_fixture("extracts.json")
+        self.imageinfo = load_fixture("imageinfo.json")
+        self.sections = load_fixture("parse_sections.json")
+        self.wiktionary_sections = load_fixture("wiktionary_sections.json")
+        self.wiktionary = load_fixture("wiktionary.html")
+        self.section_html = load_fixture("section_basic.html", CORPUS)
+
+        start = self.wiktionary.index('<div class="mw-heading mw-heading2"><h2 id="English">')
+        end = self.wiktionary.index("<hr>", start)
+        self.wiktionary_english = self.wiktionary[start:end]
+
+    @staticmethod
+    def fill_json(template: str, title: str) -> dict:
+        return json.loads(template.replace(PLACEHOLDER, json.dumps(title)[1:-1]))
+
+    def api(self, host: str, params: Dict[str, str]) -> dict:
+        action = params.get("action")
+        prop = params.get("prop", "")
+
+        if action == "query" and params.get("list") == "search":
+            return self.fill_json(self.search, params["srsearch"])
+
+        if action == "query" and params.get("generator") == "search":
+            page = self.fill_json(self.extract, params["gsrsearch"])
+            page["index"] = 1
+            return {"batchcomplete": "", "query": {"pages": {str(page["pageid"]): page}}}
+
+        if action == "query" and prop == "extracts":
+            pages = {}
+            normalized = []
+            for number, title in enumerate(params["titles"].split("|")):
+                if "_" in title:
+                    normalized.append({"from": title, "to": title.replace("_", " ")})
+                    title = title.replace("_", " ")
+                pages[str(1000 + number)] = self.fill_json(self.extract, title)
+            return {"batchcomplete": "", "query": {"normalized": normalized, "pages": pages}}
+
+        if action == "query" and prop == "imageinfo":
+            return self.fill_json(self.imageinfo, params["titles"])
+
+        if action == "parse" and "text" not in prop:
+            template = self.wiktionary_sections if host == impl.SERVER else self.sections
+            return self.fill_json(template, params["page"])
+
+        if action == "parse":
+            title = params["page"]
+            if host == impl.SERVER:
+                return {"parse": {"title": title, "text": {"*": self.wiktionary_english}}}
+
+            number = params.get("section", "0")
+            sections = self.fill_json(self.sections, title)["parse"]["sections"]
+            return {
+                "parse": {
+                    "title": title,
+                    "text": {"*": self.section_html},
+                    "sections": [entry for entry in sections if int(entry["index"]) >= int(number)],
+                }
+            }
+
+        return {"error": {"code": "badvalue", "info": "Not recorded: {!r}".format(params)}}
+
+    def index(self, params: Dict[str, str]) -> str:
+        return self.wiktionary.replace(PLACEHOLDER, html.escape(params.get("title", "")))
+
+
+class FixtureServer(ThreadingHTTPServer):
+    """Stand-in for the Wikimedia hosts, answering from :class:`Fixtures`."""
+
+    daemon_threads = True
+    request_queue_size = 128  # the default of 5 drops connections under load
+
+    def __init__(self, latency: float = 0.05, jitter: float = 0.0):
+        super().__init__(("127.0.0.1", 0), FixtureHandler)
+        self.fixtures = Fixtures()
+        self.latency = latency
+        self.jitter = jitter
+        self.hits = 0
+        self._lock = threading.Lock()
+
+    @property
+    def address(self) -> str:
+        return "{}:{}".format(*self.server_address[:2])
+
+    def delay(self) -> None:
+        delay = self.latency + random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def count(self) -> None:
+        with self._lock:
+            self.hits += 1
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real servers
+    server: FixtureServer
+
+    def do_GET(self):
+        self.server.count()
+        self.server.delay()
+
+        parts = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(parts.query, keep_blank_values=True).items()}
+        host = self.headers.get("Host", "")
+
+        if parts.path.endswith("/index.php"):
+            self.respond(self.server.fixtures.index(params), "text/html; charset=UTF-8")
+        elif parts.path.endswith("/api.php"):
+            body = json.dumps(self.server.fixtures.api(host, params))
+            self.respond(body, "application/json; charset=utf-8")
+        else:
+            self.respond("Not found", "text/plain", status=404)
+
+    def respond(self, body: str, content_type: str, status: int = 200) -> None:
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalAdapter(HTTPAdapter):
+    """Send ``https://`` requests for any host to the local server instead."""
+
+    def __init__(self, address: str, **kwargs):
+        self.address = address
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.headers["Host"] = parts.netloc
+        request.url = urlunsplit(("http", self.address, parts.path, parts.query, parts.fragment))
+        return super().send(request, **kwargs)
+
+
+def point_client_at(server: FixtureServer, hosts: List[str]) -> None:
+    """Make the shared client send requests for ``hosts`` to ``server``."""
+    shared = client.get_client()
+    shared.rate_limit = 0
+    for host in hosts:
+        adapter = LocalAdapter(server.address, pool_connections=1, pool_maxsize=shared.pool_size)
+        shared.session(host).mount("https://", adapter)
+
+
+Operation = Callable[[str], Tuple[str, str, tuple]]
+
+OPERATIONS: Dict[str, Operation] = {
+    "mw_snippet": lambda title: ("mw_snippet", WIKIPEDIA, (quote(title.replace(" ", "_")),)),
+    "mw_search": lambda title: ("mw_search", WIKIPEDIA, (title, 1)),
+    "mw_search_snippet": lambda title: ("mw_search_snippet", WIKIPEDIA, (title,)),
+    "mw_section": lambda title: ("mw_section", WIKIPEDIA, (title, SECTION, TEXT_BUDGET)),
+    "mw_image_description": lambda title: (
+        "mw_image_description", WIKIPEDIA, ("File:{}.jpg".format(title), TEXT_BUDGET)
+    ),
+    "wikt": lambda title: ("wikt", impl.SERVER, (title,)),
+}
+"""How each benchmarked operation is called for a title, as in the plugins."""
+
+
+def peak_memory() -> int:
+    """Get the process's peak resident memory so far, in bytes (0 if unknown)."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run(
+    name: str,
+    server: FixtureServer,
+    requests: int,
+    concurrency: int,
+    distinct: int,
+) -> None:
+    operation = OPERATIONS[name]
+    calls = [operation("Example {}".format(number % distinct)) for number in range(requests)]
+    cache.get_cache().clear()
+    op, host, call_args = calls[0]
+    if not engine.call(op, host, *call_args) or (name == "wikt" and not impl.wikt(call_args[0]).parts):
+        raise RuntimeError("{} returned nothing; do the fixtures still match?".format(name))
+    cache.get_cache().clear()
+
+    hits_before = server.hits
+    memory_before = peak_memory()
+
+    def timed(call):
+        op, host, args = call
+        start = time.perf_counter()
+        engine.call(op, host, *args)
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(concurrency) as callers:
+        latencies = list(callers.map(timed, calls))
+    elapsed = time.perf_counter() - started
+
+    print(
+        "{:<22} {:>8.1f} req/s  p50 {:7.1f} ms  p99 {:7.1f} ms  {:>5} upstream  +{:.1f} MiB peak".format(
+            name,
+            requests / elapsed,
+            percentile(latencies, 0.5) * 1000,
+            percentile(latencies, 0.99) * 1000,
+            server.hits - hits_before,
+            (peak_memory() - memory_before) / 1024 / 1024,
+        )
+    )
+
+
+def main(argv: List[str]) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("operations", nargs="*", metavar="operation", help=", ".join(OPERATIONS))
+    parser.add_argument("--latency", type=float, default=50, help="server delay per request, in ms")
+    parser.add_argument("--jitter", type=float, default=10, help="random variation of the delay, in ms")
+    parser.add_argument("--concurrency", type=int, default=16, help="lookups running at once")
+    parser.add_argument("--requests", type=int, default=400, help="lookups per operation")
+    parser.add_argument("--distinct", type=int, default=0, help="distinct titles (default: all)")
+    parser.add_argument("--max-concurrency", type=int, default=engine.get_engine().max_concurrency)
+    parser.add_argument("--max-host-concurrency", type=int, default=engine.get_engine().max_host_concurrency)
+    parser.add_argument("--wiktionary-backend", choices=["index", "parse"], default=impl.backend)
+    args = parser.parse_args(argv)
+    unknown = set(args.operations) - set(OPERATIONS)
+    if unknown:
+        parser.error("unknown operation(s): {}".format(", ".join(sorted(unknown))))
+
+    impl.backend = args.wiktionary_backend
+    engine.get_engine().max_concurrency = args.max_concurrency
+    engine.get_engine().max_host_concurrency = args.max_host_concurrency
+    engine.start()
+    server = FixtureServer(args.latency / 1000, args.jitter / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    point_client_at(server, [WIKIPEDIA, impl.SERVER])
+
+    print(
+        "{} lookups per operation, {} at once, {:.0f}±{:.0f} ms server latency, "
+        "engine limits {}/{} per host".format(
+            args.requests,
+            args.concurrency,
+            args.latency,
+            args.jitter,
+            args.max_concurrency,
+            args.max_host_concurrency,
+        )
+    )
+    try:
+        for name in args.operations or list(OPERATIONS):
+            run(name, server, args.requests, args.concurrency, args.distinct or args.requests)
+    finally:
+        engine.close()
+        client.close()
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,83 @@
+"""Benchmark ``WikiParser`` over section HTML.
+
+Usage::
+
+    $ python benchmarks/bench_parser.py [--max-us-per-kb N] [section.html ...]
+
+Pass the ``parse.text["*"]`` HTML of sections saved from
+``action=parse&prop=text&section=N`` to benchmark real sections; without
+arguments, a synthetic long section is generated. With ``--max-us-per-kb``,
+exits with an error if parsing is slower than that, to catch regressions.
+"""
+
+from __future__ import annotations
+
+import argparse
+import sys
+import timeit
+
+from sopel_wikimedia.wikipedia.parser import WikiParser
+
+
+def synthetic_section(paragraphs: int = 200) -> str:
+    """Generate section HTML with the kinds of markup the parser skips."""
+    parts = [
+        '<div class="mw-heading mw-heading2"><h2 id="History">History</h2>'
+        '<span class="mw-editsection"><span class="mw-editsection-bracket">[</span>'
+        '<a href="#">edit</a><span class="mw-editsection-bracket">]</span></span></div>',
+        '<div role="note" class="hatnote navigation-not-searchable">Main article: '
+        '<a href="#">History of things</a></div>',
+        '<table class="box-Unreferenced plainlinks metadata ambox ambox-content">'
+        "<tr><td>This section needs citations.</td></tr></table>",
+    ]
+    for i in range(paragraphs):
+        parts.append(
+            '<div class="thumb tright"><div class="thumbinner">Caption {}</div></div>'
+            "<p>Paragraph {} with <b>bold</b>, <a href=\"#\">links</a> and a "
+            'citation.<sup id="cite_ref-{}" class="reference"><a href="#">[{}]</a></sup>'
+            "</p>\n<ul><li>Item one</li><li>Item two</li></ul>".format(i, i, i, i)
+        )
+    parts.append('<ol class="references"><li>Reference</li></ol>')
+    return "\n".join(parts)
+
+
+def parse(html: str) -> str:
+    parser = WikiParser("History")
+    parser.feed(html)
+    return parser.get_result()
+
+
+def bench(name: str, html: str, number: int = 20) -> float:
+    elapsed = min(timeit.repeat(lambda: parse(html), number=number, repeat=5)) / number
+    kb = len(html.encode("utf-8")) / 1024
+    us_per_kb = elapsed * 1e6 / kb
+    print(
+        "{:<30} {:8.1f} KB  {:8.2f} ms  {:8.1f} us/KB".format(
+            name[:30], kb, elapsed * 1000, us_per_kb
+        )
+    )
+    return us_per_kb
+
+
+def main(argv: list[str]) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--max-us-per-kb", type=float)
+    parser.add_argument("files", nargs="*")
+    args = parser.parse_args(argv)
+
+    if args.files:
+        results = []
+        for path in args.files:
+            with open(path, encoding="utf-8") as section:
+                results.append(bench(path, section.read()))
+    else:
+        results = [bench("<synthetic>", synthetic_section())]
+
+    if args.max_us_per_kb is not None and max(results) > args.max_us_per_kb:
+        print("Slower than {} us/KB".format(args.max_us_per_kb))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,77 @@
+"""Benchmark per-message handling of Wikipedia links.
+
+Compares resolving the links in a message with :func:`resolve_url` against the
+inline parsing the ``mw_info`` callable used to do for every link. "cold" is
+for links seen for the first time (on wikis linked before); "memoized" for
+links pasted again. Both should beat "old".
+
+Usage::
+
+    $ python benchmarks/bench_urls.py
+"""
+
+from __future__ import annotations
+
+import re
+import timeit
+from urllib.parse import unquote, urlparse
+
+from sopel_wikimedia.wikipedia import urls
+
+MESSAGE = " ".join(
+    [
+        "have a look at https://en.wikipedia.org/wiki/Python_(programming_language)",
+        "and https://en.m.wikipedia.org/wiki/Guido_van_Rossum#Early_life",
+        "or https://de.wikipedia.org/wiki/M%C3%BCnchen#/media/Datei:Muenchen_Panorama.jpg",
+        "plus https://en.wikipedia.org/wiki/IRC#cite_note-3",
+    ]
+)
+
+
+def old_resolve(match):
+    """What ``mw_info`` did for each link before, kept for comparison."""
+    server = match.group(1)
+    page_info = urlparse(match.group(0))
+    article = unquote(page_info.path)[len("/wiki/"):]
+    section = unquote(page_info.fragment)
+    if article.startswith("Special:"):
+        return None
+    if section:
+        if section.startswith("cite_note-"):
+            return server, article
+        elif section.startswith("/media"):
+            return server, section[7:]
+        return server, article, section
+    return server, article
+
+
+def old_message(message):
+    # Sopel compiles plugin URL patterns once, so only the per-link work differs
+    snippet = re.sub(r"\s+", " ", "An   extract  with\n  odd   whitespace.")
+    return snippet, [old_resolve(m) for m in urls.R_URL.finditer(message)]
+
+
+def new_message(message):
+    snippet = urls.R_WHITESPACE.sub(" ", "An   extract  with\n  odd   whitespace.")
+    return snippet, [urls.resolve_url(m.group(0)) for m in urls.R_URL.finditer(message)]
+
+
+def main() -> None:
+    number = 20000
+    old = min(timeit.repeat(lambda: old_message(MESSAGE), number=number, repeat=5))
+    new = min(timeit.repeat(lambda: new_message(MESSAGE), number=number, repeat=5))
+
+    def cold():
+        urls.resolve_url.cache_clear()
+        new_message(MESSAGE)
+
+    cold_time = min(timeit.repeat(cold, number=number, repeat=5))
+
+    links = len(list(urls.R_URL.finditer(MESSAGE)))
+    print("{} links per message".format(links))
+    for name, elapsed in (("old", old), ("new (cold)", cold_time), ("new (memoized)", new)):
+        print("{:<16} {:7.2f} us/message".format(name, elapsed / number * 1e6))
+
+
+if __name__ == "__main__":
+    main()
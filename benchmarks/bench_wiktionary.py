@@ -0,0 +1,104 @@
+"""Benchmark the Wiktionary entry parser.
+
+Compares the single-pass heading matcher in ``parse_entry`` against the
+previous approach of testing every part of speech on every line, which also
+cleaned up every definition instead of leaving that until one is shown.
+
+Usage::
+
+    $ python benchmarks/bench_wiktionary.py [saved-page.html ...]
+
+Pass pages saved from ``https://en.wiktionary.org/w/index.php?title=...&printable=yes``
+to benchmark real entries; without arguments, a synthetic entry is generated.
+"""
+
+from __future__ import annotations
+
+import sys
+import timeit
+
+from sopel_wikimedia.wiktionary import impl
+
+
+def synthetic_page(senses: int = 400) -> str:
+    """Generate an entry shaped like a large real one (e.g. "set")."""
+    lines = ["<html><body>", '<h2 id="English">English</h2>']
+    for n, pos in enumerate(["Noun", "Verb", "Adjective", "Adverb"] * 3):
+        lines.append('<h3 id="Etymology_{}">Etymology {}</h3>'.format(n, n))
+        lines.append("<p>From Middle English <i>sette</i>, from Old English.</p>")
+        lines.append('<h4 id="{}">{}</h4>'.format(pos, pos))
+        lines.append("<ol>")
+        for i in range(senses // 12):
+            lines.append(
+                '<li>(transitive) Sense {} of the {}.<sup id="cite_ref-{}" '
+                'class="reference"><a href="#cite_note-{}">[{}]</a></sup>'
+                "<ul><li>An example.</li></ul></li>".format(i, pos, i, i, i)
+            )
+        lines.append("</ol>")
+    lines.append("<hr>")
+    lines.extend("<p>Other languages: line {}</p>".format(i) for i in range(2000))
+    lines.append("</body></html>")
+    return "\n".join(lines)
+
+
+def old_parse_entry(lines):
+    """The matcher ``parse_entry`` used before, kept for comparison."""
+    mode = None
+    etymology = None
+    definitions = {}
+
+    for line in lines:
+        is_new_mode = False
+        if 'id="Etymology' in line:
+            mode = "etymology"
+            is_new_mode = True
+        else:
+            for pos in impl.PARTS_OF_SPEECH:
+                if 'id="{}"'.format(pos.replace(" ", "_")) in line:
+                    mode = pos.lower()
+                    is_new_mode = True
+                    break
+
+        if not is_new_mode:
+            if (mode == "etymology") and ("<p>" in line):
+                if etymology is not None:
+                    etymology += " " + impl.text(line)
+                else:
+                    etymology = impl.text(line)
+            elif ('id="' in line) and ("<li>" not in line):
+                mode = None
+            elif (mode is not None) and ("<li>" in line):
+                definitions.setdefault(mode, []).append(impl.text(line))
+
+        if "<hr" in line:
+            break
+
+    return etymology, definitions
+
+
+def bench(name: str, html: str, number: int = 20) -> None:
+    lines = list(impl.strip_lists(html.splitlines()))
+    entry = impl.parse_entry(lines)
+    assert old_parse_entry(lines) == (entry.etymology, entry.definitions()), name
+
+    old = min(timeit.repeat(lambda: old_parse_entry(lines), number=number, repeat=5))
+    new = min(timeit.repeat(lambda: impl.parse_entry(lines), number=number, repeat=5))
+    print(
+        "{:<30} {:>6} lines  old {:8.2f} ms  new {:8.2f} ms  {:5.2f}x".format(
+            name[:30], len(lines), old / number * 1000, new / number * 1000, old / new
+        )
+    )
+
+
+def main(argv: list[str]) -> None:
+    if not argv:
+        bench("<synthetic>", synthetic_page())
+        return
+
+    for path in argv:
+        with open(path, encoding="utf-8") as page:
+            bench(path, page.read())
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
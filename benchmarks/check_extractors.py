@@ -0,0 +1,112 @@
+"""Check that every HTML extraction engine produces the same text.
+
+Usage::
+
+    $ python benchmarks/check_extractors.py [file.html ...]
+
+Without arguments, the HTML files in ``benchmarks/corpus`` are checked, along
+with a long synthetic section. Each file is extracted with every available
+engine, with and without a budget, and any difference between the engines is
+reported, as is any difference from the text expected for a corpus file in
+``benchmarks/corpus/expected.json``. Engines are
+timed without a budget and with the plugin's :data:`TEXT_BUDGET`, which should
+let them stop long before the end of a long section. Exits with an error if an
+engine disagrees or gets a corpus file wrong.
+"""
+
+from __future__ import annotations
+
+import glob
+import json
+import os
+import re
+import sys
+import timeit
+
+from bench_parser import synthetic_section
+
+from sopel_wikimedia.wikipedia.extract import EXTRACTORS
+from sopel_wikimedia.wikipedia.plugin import TEXT_BUDGET
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "corpus")
+EXPECTED = os.path.join(CORPUS, "expected.json")
+"""Expected text of each corpus file, by budget (``none`` for no budget)."""
+BUDGETS = (None, 40, 200)
+R_HEADING = re.compile(r"<h\d[^>]*>(?:<span[^>]*>)?([^<]+)<")
+
+
+def available_extractors():
+    extractors = []
+    for name, cls in sorted(EXTRACTORS.items()):
+        try:
+            extractors.append(cls())
+        except ImportError:
+            print("Skipping {}: not installed".format(name))
+    return extractors
+
+
+def time_extract(extractor, html: str, section_name: str, budget) -> str:
+    number = 5 if len(html) > 100_000 else 20
+    elapsed = min(
+        timeit.repeat(lambda: extractor.extract(html, section_name, budget), number=number, repeat=3)
+    ) / number
+    return "{} {:.3f} ms".format(extractor.name, elapsed * 1000)
+
+
+def check(name: str, html: str, extractors, expected=None) -> bool:
+    heading = R_HEADING.search(html)
+    section_name = heading.group(1) if heading else ""
+
+    ok = True
+    for budget in BUDGETS:
+        results = {
+            extractor.name: extractor.extract(html, section_name, budget)
+            for extractor in extractors
+        }
+        if len(set(results.values())) > 1:
+            ok = False
+            print("MISMATCH {} (budget={}):".format(name, budget))
+            for engine, text in results.items():
+                print("  {:<12} {!r}".format(engine, text))
+
+        if expected is not None:
+            want = expected["none" if budget is None else str(budget)]
+            wrong = {engine: text for engine, text in results.items() if text != want}
+            if wrong:
+                ok = False
+                print("WRONG {} (budget={}):".format(name, budget))
+                print("  {:<12} {!r}".format("expected", want))
+                for engine, text in wrong.items():
+                    print("  {:<12} {!r}".format(engine, text))
+
+    for budget in (None, TEXT_BUDGET):
+        timings = "  ".join(time_extract(extractor, html, section_name, budget) for extractor in extractors)
+        print("{:<7} {:<30} budget={:<5} {}".format("ok" if ok else "FAIL", name, str(budget), timings))
+    return ok
+
+
+def read(path: str) -> str:
+    with open(path, encoding="utf-8") as document:
+        return document.read()
+
+
+def main(argv: list[str]) -> int:
+    with open(EXPECTED, encoding="utf-8") as expected_file:
+        expected = json.load(expected_file)
+
+    if argv:
+        documents = [(os.path.basename(path), read(path)) for path in argv]
+    else:
+        documents = [
+            (os.path.basename(path), read(path))
+            for path in sorted(glob.glob(os.path.join(CORPUS, "*.html")))
+        ]
+        documents.append(("<synthetic, long>", synthetic_section(6000)))
+
+    extractors = available_extractors()
+    results = [check(name, html, extractors, expected.get(name)) for name, html in documents]
+    return 0 if all(results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
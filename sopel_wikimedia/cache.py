@@ -0,0 +1,466 @@
+"""In-memory response cache for Wikimedia lookups.
+
+Entries are keyed on ``(kind, server, title, section)`` and expire after a
+per-kind TTL. The cache is bounded both by entry count and by an estimate of
+the memory its values use; the least recently used entries go first.
+
+Optionally, a persistent backend (see :mod:`sopel_wikimedia.diskcache`) can
+be attached as a second tier that survives restarts.
+"""
+
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import (Any, Callable, Dict, Hashable, Iterable, List, Mapping,
+                    Optional, Set, Tuple, TypeVar)
+from urllib.parse import unquote
+
+from . import metrics, singleflight
+from .diskcache import SQLiteCache
+
+LOGGER = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+CacheKey = Tuple[str, str, str, Optional[Hashable]]
+
+DEFAULT_MAX_ENTRIES = 2048
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_TTL = 600
+DEFAULT_NEGATIVE_TTL = 60
+DEFAULT_STALE_TTL = 300
+DEFAULT_TTLS: Dict[str, float] = {
+    "snippet": 600,
+    "section": 600,
+    "sections": 3600,
+    "image": 3600,
+    "search": 300,
+    "entity": 3600,
+    "wiktionary": 3600,
+}
+
+FRESH = "fresh"
+STALE = "stale"
+MISS = "miss"
+
+
+def normalize_title(title: str) -> str:
+    """Normalize a page title so equivalent spellings share a cache entry."""
+    return " ".join(unquote(title).replace("_", " ").split())
+
+
+def make_key(
+    kind: str,
+    server: str,
+    title: str,
+    section: Optional[Hashable] = None,
+) -> CacheKey:
+    return (kind, server.lower(), normalize_title(title), section)
+
+
+def estimate_size(value: Any) -> int:
+    """Roughly estimate how many bytes ``value`` keeps alive."""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return 8 * len(value) + sum(estimate_size(item) for item in value)
+    if isinstance(value, dict):
+        return 16 * len(value) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    return 64
+
+
+class _Entry:
+    __slots__ = ("value", "kind", "expires", "size")
+
+    def __init__(self, value: Any, kind: str, expires: float, size: int):
+        self.value = value
+        self.kind = kind
+        self.expires = expires
+        self.size = size
+
+
+class ResponseCache:
+    """Bounded LRU cache with per-kind expiry.
+
+    :param max_entries: maximum number of entries to keep
+    :param max_bytes: maximum estimated size of all cached values
+    :param ttls: seconds before entries of each kind expire; kinds not listed
+                 here use ``default_ttl``
+    :param backend: optional persistent store consulted on memory misses
+    :param negative_ttl: seconds before ``None`` values ("no such page")
+                         expire, regardless of their kind
+    :param stale_ttl: seconds after expiring during which an entry can still
+                      be served, see :meth:`lookup`
+
+    ``None`` values are never served stale.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        ttls: Optional[Dict[str, float]] = None,
+        default_ttl: float = DEFAULT_TTL,
+        backend: Optional[SQLiteCache] = None,
+        negative_ttl: float = DEFAULT_NEGATIVE_TTL,
+        stale_ttl: float = DEFAULT_STALE_TTL,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.backend = backend
+        self.negative_ttl = negative_ttl
+        self.stale_ttl = stale_ttl
+
+        self._entries: OrderedDict[CacheKey, _Entry] = OrderedDict()
+        self._lock = threading.RLock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.stale_hits = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def ttl(self, kind: str) -> float:
+        return self.ttls.get(kind, self.default_ttl)
+
+    def lookup(self, key: CacheKey, count: bool = True) -> Tuple[str, Any]:
+        """Look up ``key``, including entries that have only just expired.
+
+        :param count: whether to count this lookup in the hit/miss statistics
+        :return: a ``(state, value)`` tuple, where ``state`` is :data:`FRESH`,
+                 :data:`STALE` (expired less than ``stale_ttl`` seconds ago;
+                 the caller should refresh it), or :data:`MISS` (``value`` is
+                 ``None``)
+        """
+        now = time.monotonic()
+        stale = None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires > now:
+                self._entries.move_to_end(key)
+                self.hits += count
+                return FRESH, entry.value
+
+            if entry is not None:
+                if entry.value is not None and entry.expires + self.stale_ttl > now:
+                    stale = entry
+                else:
+                    self._remove(key)
+
+        backend = self.backend
+        if backend is not None:
+            found, value, expires = backend.get(key)
+            if found:
+                with self._lock:
+                    self.hits += count
+                    self.disk_hits += count
+                self._store(key, value, expires - time.time())
+                return FRESH, value
+
+        with self._lock:
+            if stale is not None:
+                self.stale_hits += count
+                return STALE, stale.value
+
+            self.misses += count
+        return MISS, None
+
+    def get(self, key: CacheKey, count: bool = True) -> Tuple[bool, Any]:
+        """Look up ``key``, ignoring expired entries.
+
+        :param count: whether to count this lookup in the hit/miss statistics
+        :return: a ``(found, value)`` tuple; ``value`` is ``None`` on a miss
+        """
+        state, value = self.lookup(key, count=False)
+        with self._lock:
+            if state == FRESH:
+                self.hits += count
+                return True, value
+
+            self.misses += count
+        return False, None
+
+    def remaining(self, key: CacheKey) -> Optional[float]:
+        """Get how many seconds ``key`` stays cached in memory.
+
+        :return: the remaining time, or ``None`` if ``key`` is not cached
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            remaining = entry.expires - time.monotonic()
+        return remaining if remaining > 0 else None
+
+    def set(self, key: CacheKey, value: Any) -> None:
+        """Cache ``value`` for ``key``.
+
+        ``None`` is cached as a negative result, expiring after ``negative_ttl``.
+        """
+        self.set_many([(key, value)])
+
+    def set_many(self, items: Iterable[Tuple[CacheKey, Any]]) -> None:
+        """Cache several ``(key, value)`` pairs; see :meth:`set`.
+
+        The persistent backend, if any, stores them all at once.
+        """
+        stored = []
+        for key, value in items:
+            ttl = self.negative_ttl if value is None else self.ttl(key[0])
+            if ttl > 0:
+                self._store(key, value, ttl)
+                stored.append((key, value, ttl))
+
+        backend = self.backend
+        if backend is not None and stored:
+            backend.set_many(stored)
+
+    def _store(self, key: CacheKey, value: Any, ttl: float) -> None:
+        kind = key[0]
+        size = estimate_size(value)
+        if size > self.max_bytes:
+            LOGGER.debug("Not caching %r: value too large (%d bytes)", key, size)
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(value, kind, time.monotonic() + ttl, size)
+            self.size += size
+            self._evict()
+
+    def delete(self, key: CacheKey) -> None:
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+        backend = self.backend
+        if backend is not None:
+            backend.delete(key)
+
+    def _remove(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key)
+        self.size -= entry.size
+
+    def _evict(self) -> None:
+        while self._entries and (
+            len(self._entries) > self.max_entries or self.size > self.max_bytes
+        ):
+            _key, entry = self._entries.popitem(last=False)
+            self.size -= entry.size
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale_hits
+            return {
+                "hit_ratio": (self.hits + self.stale_hits) / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "stale_hits": self.stale_hits,
+                "evictions": self.evictions,
+            }
+
+
+_cache = ResponseCache()
+
+
+def get_cache() -> ResponseCache:
+    """Get the shared cache instance."""
+    return _cache
+
+
+def cached(
+    kind: str,
+    server: str,
+    title: str,
+    loader: Callable[[], T],
+    section: Optional[Hashable] = None,
+) -> T:
+    """Get a value from the shared cache, calling ``loader`` on a miss.
+
+    Concurrent misses for the same key share a single call to ``loader``.
+    Entries that expired only recently are returned straight away while
+    ``loader`` refreshes them in the background. ``None`` results are cached
+    as negative results with a short TTL. Exceptions raised by ``loader`` are
+    propagated to every waiting caller and nothing is cached.
+    """
+    key = make_key(kind, server, title, section)
+    state, value = _cache.lookup(key)
+    metrics.inc("cache_lookups_total", kind=kind, result=state)
+    if state == FRESH:
+        return value
+
+    def load():
+        # another thread may have just finished loading this key
+        found, value = _cache.get(key, count=False)
+        if found:
+            return value
+
+        value = loader()
+        _cache.set(key, value)
+        return value
+
+    if state == STALE:
+        _refresh(key, load)
+        return value
+
+    return singleflight.do(key, load)
+
+
+def cached_many(
+    kind: str,
+    server: str,
+    titles: Iterable[str],
+    loader: Callable[[List[str]], Mapping[str, Any]],
+    refresh: bool = False,
+) -> Dict[str, Any]:
+    """Get several values from the shared cache, loading the missing ones at once.
+
+    Works like :func:`cached` for each of ``titles``, except that the titles
+    not cached are passed to a single call to ``loader``, which returns a
+    mapping of titles to values; titles missing from it are cached as
+    negative results. Concurrent calls for the same titles share that call,
+    and recently expired entries are refreshed in the background with one.
+
+    :param refresh: load every title, ignoring what is cached
+    :return: a dict mapping each of ``titles`` to its value
+    """
+    results: Dict[str, Any] = {}
+    stale: List[str] = []
+    missing: List[str] = []
+    for title in titles:
+        if title in results or title in missing:
+            continue
+        if refresh:
+            missing.append(title)
+            continue
+
+        state, value = _cache.lookup(make_key(kind, server, title))
+        metrics.inc("cache_lookups_total", kind=kind, result=state)
+        if state == MISS:
+            missing.append(title)
+            continue
+        results[title] = value
+        if state == STALE:
+            stale.append(title)
+
+    def loads(batch: List[str]) -> Tuple[CacheKey, Callable[[], Mapping[str, Any]]]:
+        def load():
+            values = loader(batch)
+            _cache.set_many((make_key(kind, server, title), values.get(title)) for title in batch)
+            return values
+
+        # not a real cache entry; only identifies the batch in flight
+        return make_key(kind, server, "|".join(batch), "batch"), load
+
+    if stale:
+        _refresh(*loads(stale))
+    if missing:
+        values = singleflight.do(*loads(missing))
+        results.update((title, values.get(title)) for title in missing)
+    return results
+
+
+_refresher: Optional[concurrent.futures.ThreadPoolExecutor] = None
+_refresher_lock = threading.Lock()
+_refreshes: Set[concurrent.futures.Future] = set()
+"""Background refreshes not done yet, so that :func:`close` can cancel them."""
+
+
+def _refresh(key: CacheKey, load: Callable[[], Any]) -> None:
+    global _refresher
+
+    if singleflight.get_flights().is_running(key):
+        return
+
+    with _refresher_lock:
+        if _refresher is None:
+            _refresher = concurrent.futures.ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="sopel-wikimedia-refresh"
+            )
+        future = _refresher.submit(_run_refresh, key, load)
+        _refreshes.add(future)
+    future.add_done_callback(_forget_refresh)
+
+
+def _forget_refresh(future: concurrent.futures.Future) -> None:
+    with _refresher_lock:
+        _refreshes.discard(future)
+
+
+def _run_refresh(key: CacheKey, load: Callable[[], Any]) -> None:
+    try:
+        singleflight.do(key, load)
+    except Exception:
+        LOGGER.exception("Error refreshing stale cache entry %r", key)
+
+
+def parse_ttls(values) -> Dict[str, float]:
+    """Parse ``kind=seconds`` config values into a TTL mapping."""
+    ttls = dict(DEFAULT_TTLS)
+    for item in values or []:
+        kind, sep, seconds = item.partition("=")
+        if not sep:
+            raise ValueError("Invalid cache TTL {!r}, expected kind=seconds".format(item))
+        ttls[kind.strip()] = float(seconds)
+    return ttls
+
+
+def configure(settings: Any) -> None:
+    """Configure the shared cache from the ``[wikipedia]`` config section."""
+    with _cache._lock:
+        _cache.max_entries = settings.cache_max_entries
+        _cache.max_bytes = settings.cache_max_bytes
+        _cache.ttls = parse_ttls(settings.cache_ttls)
+        _cache.negative_ttl = settings.cache_negative_ttl
+        _cache.stale_ttl = settings.cache_stale_ttl
+        _cache._evict()
+
+    if settings.cache_path and _cache.backend is None:
+        LOGGER.info("Using persistent response cache at %s", settings.cache_path)
+        _cache.backend = SQLiteCache(
+            settings.cache_path, settings.cache_max_disk_bytes
+        )
+
+
+def close() -> None:
+    """Empty the shared cache and close its persistent backend, if any."""
+    global _refresher
+
+    with _refresher_lock:
+        refresher, _refresher = _refresher, None
+        pending = list(_refreshes)
+    # don't hold up shutdown for refreshes nobody is waiting for; those
+    # already running are left to finish on their own (cancel_futures would
+    # do this, but needs Python 3.9)
+    for future in pending:
+        future.cancel()
+    if refresher is not None:
+        refresher.shutdown(wait=False)
+
+    _cache.clear()
+    backend, _cache.backend = _cache.backend, None
+    if backend is not None:
+        backend.close()
@@ -0,0 +1,273 @@
+"""Shared HTTP client for Wikimedia API requests.
+
+Both plugins send all of their requests through this module, so connections to
+each Wikimedia host are pooled and kept alive between lookups instead of paying
+for a new TCP+TLS handshake every time.
+
+Requests to each host also go through a token bucket, API requests carry the
+``maxlag`` parameter, and responses asking us to slow down (HTTP 429/503 or a
+``maxlag`` error) are retried after the server's ``Retry-After`` delay or a
+jittered exponential backoff. While a host is backing off, every request to it
+waits, instead of piling more load onto it.
+"""
+
+from __future__ import annotations
+
+import logging
+import random
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sopel_wikimedia import WIKI_REQUEST_HEADERS, metrics
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 15.0
+DEFAULT_RATE_LIMIT = 10.0
+DEFAULT_RATE_BURST = 20
+DEFAULT_MAXLAG = 5
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_MAX_BACKOFF = 30.0
+BACKOFF_BASE = 0.5
+
+RETRY_STATUSES = frozenset([429, 503])
+
+
+class TokenBucket:
+    """Allow ``rate`` requests per second on average, in bursts of ``burst``.
+
+    :meth:`backoff` additionally blocks everyone until a given delay elapses.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token, returning how long to wait before using it."""
+        with self._lock:
+            now = time.monotonic()
+            if self.rate > 0:
+                self._tokens = min(
+                    float(self.burst),
+                    self._tokens + (now - self._updated) * self.rate,
+                )
+            self._updated = now
+            self._tokens -= 1
+
+            wait = max(self._blocked_until - now, 0.0)
+            if self._tokens < 0 and self.rate > 0:
+                wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def acquire(self) -> float:
+        """Wait until a request may be sent.
+
+        :return: how many seconds were spent waiting
+        """
+        if self.rate <= 0:
+            wait = max(self._blocked_until - time.monotonic(), 0.0)
+        else:
+            wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def backoff(self, delay: float) -> None:
+        """Hold back all requests for ``delay`` seconds."""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + delay)
+
+
+def retry_after(response: requests.Response) -> Optional[float]:
+    """Get the delay a response asks for, if it asks us to slow down at all."""
+    maxlagged = response.headers.get("MediaWiki-API-Error") == "maxlag"
+    if response.status_code not in RETRY_STATUSES and not maxlagged:
+        return None
+
+    value = response.headers.get("Retry-After", "")
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        # could be an HTTP date, but Wikimedia sends seconds; fall back to backoff
+        return 0.0
+
+
+class WikimediaClient:
+    """Keep one pooled, keep-alive :class:`requests.Session` per host."""
+
+    def __init__(
+        self,
+        pool_size: int = DEFAULT_POOL_SIZE,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        rate_limit: float = DEFAULT_RATE_LIMIT,
+        rate_burst: int = DEFAULT_RATE_BURST,
+        maxlag: int = DEFAULT_MAXLAG,
+        max_retries: int = DEFAULT_MAX_RETRIES,
+        max_backoff: float = DEFAULT_MAX_BACKOFF,
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.maxlag = maxlag
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self._sessions: Dict[str, requests.Session] = {}
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self) -> tuple[float, float]:
+        return (self.connect_timeout, self.read_timeout)
+
+    def _new_session(self) -> requests.Session:
+        session = requests.Session()
+        session.headers.update(WIKI_REQUEST_HEADERS)
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    def session(self, host: str) -> requests.Session:
+        """Get the session used for ``host``, creating it if needed."""
+        session = self._sessions.get(host)
+        if session is not None:
+            return session
+
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                LOGGER.debug("Opening HTTP session for %s", host)
+                session = self._sessions[host] = self._new_session()
+        return session
+
+    def bucket(self, host: str) -> TokenBucket:
+        """Get the rate limiter for ``host``, creating it if needed."""
+        bucket = self._buckets.get(host)
+        if bucket is not None:
+            return bucket
+
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(
+                    self.rate_limit, self.rate_burst
+                )
+        return bucket
+
+    def backoff_delay(self, attempt: int, requested: Optional[float]) -> float:
+        """Get how long to wait before retry number ``attempt`` (from 0)."""
+        if requested:
+            delay = requested
+        else:
+            # "full jitter" exponential backoff
+            delay = random.uniform(0, BACKOFF_BASE * 2 ** attempt)
+        return min(delay, self.max_backoff)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Send a ``GET`` request to ``url`` using the host's pooled session.
+
+        If the server asks us to slow down, the request is retried up to
+        ``max_retries`` times; the last response is returned either way.
+        """
+        parts = urlsplit(url)
+        host = parts.netloc
+        endpoint = parts.path.rsplit("/", 1)[-1]
+        if self.maxlag and parts.path.endswith("/api.php"):
+            url += "&maxlag={}".format(self.maxlag) if parts.query else "?maxlag={}".format(self.maxlag)
+
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.session(host)
+        bucket = self.bucket(host)
+
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            if waited:
+                metrics.observe("rate_limit_wait", waited, host=host)
+            # for streamed responses, this only covers the time to the headers
+            with metrics.timer("http_request", host=host, endpoint=endpoint):
+                response = session.get(url, **kwargs)
+            metrics.inc("http_responses_total", host=host, endpoint=endpoint, status=response.status_code)
+            requested = retry_after(response)
+            if requested is None or attempt >= self.max_retries:
+                return response
+
+            delay = self.backoff_delay(attempt, requested)
+            LOGGER.info(
+                "%s asked us to slow down (HTTP %d); retrying in %.1fs",
+                host,
+                response.status_code,
+                delay,
+            )
+            response.close()
+            bucket.backoff(delay)
+            attempt += 1
+
+    def get_json(self, url: str, **kwargs) -> Any:
+        """Send a ``GET`` request to ``url`` and decode its JSON response."""
+        response = self.get(url, **kwargs)
+        with metrics.timer("json_decode", host=urlsplit(url).netloc):
+            return response.json()
+
+    def close(self) -> None:
+        """Close every open session and forget about them."""
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._buckets.clear()
+
+        for session in sessions:
+            session.close()
+
+
+_client = WikimediaClient()
+
+
+def get_client() -> WikimediaClient:
+    """Get the shared client instance."""
+    return _client
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    """Send a ``GET`` request through the shared client."""
+    return _client.get(url, **kwargs)
+
+
+def get_json(url: str, **kwargs) -> Any:
+    """Send a ``GET`` request through the shared client and decode its JSON."""
+    return _client.get_json(url, **kwargs)
+
+
+def configure(settings: Any) -> None:
+    """Configure the shared client from the ``[wikipedia]`` config section."""
+    _client.pool_size = settings.http_pool_size
+    _client.connect_timeout = settings.http_connect_timeout
+    _client.read_timeout = settings.http_read_timeout
+    _client.rate_limit = settings.rate_limit
+    _client.rate_burst = settings.rate_burst
+    _client.maxlag = settings.maxlag
+    _client.max_retries = settings.max_retries
+    _client.max_backoff = settings.max_backoff
+
+
+def close() -> None:
+    """Close the shared client's sessions."""
+    _client.close()
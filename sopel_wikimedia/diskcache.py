@@ -0,0 +1,207 @@
+"""Persistent SQLite backend for the response cache.
+
+Responses are stored as zlib-compressed JSON along with a wall-clock expiry
+timestamp, so a restarted bot can keep serving pages it has already seen
+without asking the API again.
+
+The database uses write-ahead logging, so reads don't wait for writes, and
+only syncs to disk at checkpoints: losing the last few writes to a power cut
+only costs a few requests to fetch them again. Several entries stored at once
+go in one transaction, and read times (used to pick which entries to remove
+first) are written in batches instead of on every read.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Hashable, Iterable, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+COMPACT_BATCH = 500
+"""Maximum number of rows a single compaction pass will delete."""
+ACCESS_BATCH = 100
+"""How many read times to collect before writing them all at once."""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    expires REAL NOT NULL,
+    accessed REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_expires ON responses (expires);
+CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed);
+"""
+
+
+def encode_key(key: Tuple[Hashable, ...]) -> str:
+    return json.dumps(key, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteCache:
+    """Store cached responses in an SQLite database file.
+
+    :param path: location of the database file
+    :param max_bytes: compressed size the stored responses may grow to before
+                      :meth:`compact` removes the least recently used ones
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock, self._conn:
+            self._conn.executescript(SCHEMA)
+        self._accessed: Dict[str, float] = {}
+        """Read times not written to the database yet, by encoded key."""
+
+    def get(self, key: Tuple[Hashable, ...]) -> Tuple[bool, Any, float]:
+        """Look up ``key``.
+
+        :return: a ``(found, value, expires)`` tuple, where ``expires`` is a
+                 :func:`time.time` timestamp
+        """
+        now = time.time()
+        encoded = encode_key(key)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM responses WHERE key = ?",
+                (encoded,),
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return False, None, 0.0
+            self._accessed[encoded] = now
+            if len(self._accessed) >= ACCESS_BATCH:
+                self._flush_accessed()
+
+        try:
+            value = json.loads(zlib.decompress(row[0]))
+        except (zlib.error, ValueError):
+            LOGGER.warning("Discarding corrupt cache entry for %r", key)
+            self.delete(key)
+            return False, None, 0.0
+
+        return True, value, row[1]
+
+    def set(self, key: Tuple[Hashable, ...], value: Any, ttl: float) -> None:
+        self.set_many([(key, value, ttl)])
+
+    def set_many(self, items: Iterable[Tuple[Tuple[Hashable, ...], Any, float]]) -> None:
+        """Store several ``(key, value, ttl)`` entries in one transaction."""
+        now = time.time()
+        rows = []
+        for key, value, ttl in items:
+            try:
+                data = zlib.compress(
+                    json.dumps(value, ensure_ascii=False).encode("utf-8")
+                )
+            except (TypeError, ValueError):
+                LOGGER.debug("Not persisting %r: value is not serializable", key)
+                continue
+            rows.append((encode_key(key), data, len(data), now + ttl, now))
+
+        if not rows:
+            return
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO responses "
+                "(key, value, size, expires, accessed) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+
+    def delete(self, key: Tuple[Hashable, ...]) -> None:
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key = ?", (encode_key(key),)
+            )
+
+    def _flush_accessed(self) -> None:
+        # called with the lock held
+        if not self._accessed:
+            return
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE responses SET accessed = ? WHERE key = ?",
+                [(accessed, key) for key, accessed in self._accessed.items()],
+            )
+        self._accessed.clear()
+
+    def compact(self, batch: int = COMPACT_BATCH) -> int:
+        """Remove expired entries, then shrink the database below its limit.
+
+        At most ``batch`` rows are deleted per call, so a single pass never
+        holds the database for long; call again to continue.
+
+        :return: how many rows were deleted
+        """
+        with self._lock:
+            self._flush_accessed()
+        with self._lock, self._conn:
+            deleted = self._conn.execute(
+                "DELETE FROM responses WHERE key IN "
+                "(SELECT key FROM responses WHERE expires <= ? LIMIT ?)",
+                (time.time(), batch),
+            ).rowcount
+
+            total = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+
+            if total > self.max_bytes and deleted < batch:
+                excess = total - self.max_bytes
+                rows = self._conn.execute(
+                    "SELECT key, size FROM responses ORDER BY accessed LIMIT ?",
+                    (batch - deleted,),
+                ).fetchall()
+                victims = []
+                for key, size in rows:
+                    if excess <= 0:
+                        break
+                    victims.append((key,))
+                    excess -= size
+                self._conn.executemany(
+                    "DELETE FROM responses WHERE key = ?", victims
+                )
+                deleted += len(victims)
+
+        return deleted
+
+    def close(self) -> None:
+        with self._lock:
+            self._flush_accessed()
+            self._conn.close()
+
+
+class Compactor(threading.Thread):
+    """Periodically run :meth:`SQLiteCache.compact` in the background."""
+
+    def __init__(self, backend: SQLiteCache, interval: float = 300):
+        super().__init__(name="sopel-wikimedia-cache-compactor", daemon=True)
+        self.backend = backend
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                deleted = self.backend.compact()
+            except sqlite3.Error:
+                LOGGER.exception("Error compacting response cache")
+                continue
+            if deleted:
+                LOGGER.debug("Removed %d entries from response cache", deleted)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        self._stop_event.set()
+        self.join(timeout)
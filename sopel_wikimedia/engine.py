@@ -0,0 +1,213 @@
+"""Fetch engine with bounded concurrency.
+
+Every lookup the plugins make goes through the engine. A global limit and a
+per-host limit bound how many lookups can be in flight at once, no matter how
+many threads are asking; everything else waits for a free slot rather than
+holding a connection. Slots are handed out in the order they were asked for,
+so that under load no lookup waits much longer than the others.
+
+The fetch functions are blocking (they use the pooled :mod:`requests`
+sessions from :mod:`sopel_wikimedia.client`), and whoever calls :meth:`call`
+waits for the result anyway, so lookups run in the calling thread; the worker
+pool in :mod:`sopel_wikimedia.workers` bounds how many threads that can be.
+Only background lookups that nobody waits for (:meth:`submit`) are handed to
+a thread pool of their own. There is no event loop: without an asynchronous
+HTTP client, it could only hand the same blocking requests to threads.
+"""
+
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import threading
+from typing import Any, Callable, Deque, Dict, Iterator, Optional
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAX_CONCURRENCY = 8
+DEFAULT_MAX_HOST_CONCURRENCY = 4
+
+
+def _operations() -> Dict[str, Callable[..., Any]]:
+    # imported here so the fetch modules can use this one without a cycle
+    from .wikipedia import wiki
+    from .wiktionary import impl
+
+    return {
+        "mw_entity": wiki.mw_entity,
+        "mw_find_section": wiki.mw_find_section,
+        "mw_image_description": wiki.mw_image_description,
+        "mw_search": wiki.mw_search,
+        "mw_search_snippet": wiki.mw_search_snippet,
+        "mw_section": wiki.mw_section,
+        "mw_section_index": wiki.mw_section_index,
+        "mw_snippet": wiki.mw_snippet,
+        "mw_snippets": wiki.mw_snippets,
+        "wikt": lambda server, word: impl.wikt(word, server),
+    }
+
+
+class _FairSemaphore:
+    """A semaphore that hands out slots in the order they were asked for.
+
+    :class:`threading.Semaphore` lets a thread that arrives just as a slot
+    frees up take it ahead of the threads already waiting, so under load some
+    lookups wait many times longer than others. Here, a released slot goes
+    straight to the thread that has waited longest.
+    """
+
+    def __init__(self, value: int):
+        self._lock = threading.Lock()
+        self._value = value
+        self._waiters: Deque[threading.Event] = collections.deque()
+
+    def __enter__(self) -> None:
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            waiter = threading.Event()
+            self._waiters.append(waiter)
+        waiter.wait()  # the slot is ours once release() sets it
+
+    def __exit__(self, *exc_info) -> None:
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().set()
+            else:
+                self._value += 1
+
+
+class FetchEngine:
+    """Run fetch operations with bounded concurrency.
+
+    The engine must be started before use; once stopped, it refuses new
+    operations until it is started again.
+
+    :param max_concurrency: how many operations may run at once in total
+    :param max_host_concurrency: how many operations may run at once against
+                                 a single host
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+        max_host_concurrency: int = DEFAULT_MAX_HOST_CONCURRENCY,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_host_concurrency = max_host_concurrency
+
+        self._lock = threading.Lock()
+        self._executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        self._global: Optional[_FairSemaphore] = None
+        self._hosts: Dict[str, _FairSemaphore] = {}
+        self._operations: Optional[Dict[str, Callable[..., Any]]] = None
+        self.pending = 0
+        """How many operations are running or waiting for a slot."""
+
+    def start(self) -> None:
+        with self._lock:
+            if self._global is not None:
+                return
+
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="sopel-wikimedia-fetch",
+            )
+            self._hosts = {}
+            self._operations = _operations()
+            self._global = _FairSemaphore(self.max_concurrency)
+
+    def stop(self) -> None:
+        """Stop accepting operations; those already running are left to finish."""
+        with self._lock:
+            self._global = None
+            executor, self._executor = self._executor, None
+
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    @contextlib.contextmanager
+    def _slot(self, host: str) -> Iterator[None]:
+        with self._lock:
+            if self._global is None:
+                raise RuntimeError("The fetch engine is not running")
+            semaphore = self._global
+            host_semaphore = self._hosts.get(host)
+            if host_semaphore is None:
+                host_semaphore = self._hosts[host] = _FairSemaphore(self.max_host_concurrency)
+            self.pending += 1
+
+        try:
+            with host_semaphore, semaphore:
+                yield
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def call(self, operation: str, server: str, *args) -> Any:
+        """Run ``operation`` against ``server`` once a slot is free, and return its result.
+
+        ``operation`` is the name of a fetch function (e.g. ``"mw_snippet"`` or
+        ``"wikt"``); ``server`` and ``args`` are passed to it.
+
+        :raise KeyError: if ``operation`` is unknown
+        :raise RuntimeError: if the engine is not running
+        """
+        operations = self._operations
+        if operations is None:
+            raise RuntimeError("The fetch engine is not running")
+        function = operations[operation]
+
+        with self._slot(server):
+            return function(server, *args)
+
+    def submit(self, operation: str, server: str, *args) -> concurrent.futures.Future:
+        """Run ``operation`` in the background; see :meth:`call`.
+
+        :return: a future for the operation's result
+        :raise RuntimeError: if the engine is not running
+        """
+        executor = self._executor
+        if executor is None:
+            raise RuntimeError("The fetch engine is not running")
+        return executor.submit(self.call, operation, server, *args)
+
+
+_engine = FetchEngine()
+
+
+def get_engine() -> FetchEngine:
+    """Get the shared engine instance."""
+    return _engine
+
+
+def submit(operation: str, server: str, *args) -> concurrent.futures.Future:
+    """Schedule an operation on the shared engine; see :meth:`FetchEngine.submit`."""
+    return _engine.submit(operation, server, *args)
+
+
+def call(operation: str, server: str, *args) -> Any:
+    """Run an operation on the shared engine; see :meth:`FetchEngine.call`."""
+    return _engine.call(operation, server, *args)
+
+
+def configure(settings: Any) -> None:
+    """Configure the shared engine from the ``[wikipedia]`` config section.
+
+    Takes effect the next time the engine starts.
+    """
+    _engine.max_concurrency = settings.max_concurrency
+    _engine.max_host_concurrency = settings.max_host_concurrency
+
+
+def start() -> None:
+    """Start the shared engine."""
+    _engine.start()
+
+
+def close() -> None:
+    """Stop the shared engine."""
+    _engine.stop()
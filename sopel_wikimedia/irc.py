@@ -0,0 +1,82 @@
+"""Helpers for the plugins' IRC output."""
+
+from __future__ import annotations
+
+import concurrent.futures
+import functools
+import logging
+from typing import Any, Optional
+
+from . import client, workers
+
+LOGGER = logging.getLogger(__name__)
+
+FALLBACK_TEXT_LENGTH = 400
+"""Bytes of text Sopel 7.1 fits into one message, whatever the recipient."""
+
+BUSY_MESSAGE = "I'm handling too many lookups right now; try again in a bit."
+DROPPED_MESSAGE = "That lookup is taking too long; try again in a bit."
+
+
+def text_length(bot, recipient: str) -> int:
+    """Get how many bytes of text fit into one message to ``recipient``.
+
+    This includes the output prefix, if any. Sopel 8 works it out from the
+    bot's hostmask and the server's line length; older versions always split
+    messages at :data:`FALLBACK_TEXT_LENGTH` bytes.
+    """
+    try:
+        safe_text_length = bot.safe_text_length
+    except AttributeError:
+        return FALLBACK_TEXT_LENGTH
+    return safe_text_length(recipient)
+
+
+def replies_on_error(message: str, reply: bool = True):
+    """Decorate a lookup ``function(bot, trigger, ...)`` to tell the user when it fails.
+
+    Lookups run on the worker pool rather than as Sopel callables, so Sopel's
+    own error reply doesn't apply to them. The error is logged, and
+    ``message`` is replied to the user (or said, if ``reply`` is false).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(bot, trigger, *args, **kwargs):
+            try:
+                return function(bot, trigger, *args, **kwargs)
+            except Exception:
+                LOGGER.exception("Error in %s", function.__name__)
+                if reply:
+                    bot.reply(message)
+                else:
+                    bot.say(message)
+            return None
+        return wrapper
+    return decorator
+
+
+def wait_for(bot, future: Optional[concurrent.futures.Future], dropped: Any = None) -> Any:
+    """Wait for a command's lookup, submitted to the worker pool.
+
+    :param future: what :func:`sopel_wikimedia.workers.submit` returned
+    :param dropped: what to return if the lookup was dropped, usually
+                    :data:`sopel.plugin.NOLIMIT`
+    :return: the lookup's result, for the command to return; or ``dropped``,
+             in which case the user is told why
+
+    The lookup is given as long as it may wait in the pool's queue, plus as
+    long as one request may take; a lookup still running after that is left
+    to finish on its own, but the command stops waiting for it.
+    """
+    if future is None:
+        bot.reply(BUSY_MESSAGE)
+        return dropped
+
+    http = client.get_client()
+    timeout = workers.get_pool().deadline + http.connect_timeout + http.read_timeout
+    try:
+        return future.result(timeout)
+    except (concurrent.futures.CancelledError, concurrent.futures.TimeoutError):
+        future.cancel()  # in case it's still queued
+        bot.reply(DROPPED_MESSAGE)
+        return dropped
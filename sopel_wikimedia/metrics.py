@@ -0,0 +1,285 @@
+"""Lightweight counters and latency histograms for the Wikimedia plugins.
+
+Metrics are identified by a name and a set of labels (e.g. ``host`` or
+``operation``). When metrics are disabled, :func:`timer` returns a shared
+no-op context manager and :func:`inc` returns immediately, so the
+instrumentation costs next to nothing.
+"""
+
+from __future__ import annotations
+
+import bisect
+import functools
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Mapping, Optional, Sequence, Tuple
+
+Labels = Tuple[Tuple[str, str], ...]
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+"""Upper bounds of the latency histogram buckets, in seconds."""
+
+PREFIX = "sopel_wikimedia_"
+
+
+def _labels(labels: Dict[str, object]) -> Labels:
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "total")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+
+    def merge(self, other: Histogram) -> None:
+        """Add the observations of ``other`` to this histogram."""
+        self.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, q: float) -> float:
+        """Estimate the ``q`` quantile, interpolating within its bucket."""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = BUCKETS[index - 1] if index else 0.0
+                upper = BUCKETS[index] if index < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return BUCKETS[-1]
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "start")
+
+    def __init__(self, registry: Metrics, name: str, labels: Labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe_labels(self.name, self.labels, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.registry.inc_labels(self.name + "_errors_total", self.labels)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Registry of counters and latency histograms."""
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._collectors: Dict[str, Callable[[], Mapping[str, float]]] = {}
+
+    def inc(self, name: str, amount: float = 1, **labels) -> None:
+        if self.enabled:
+            self.inc_labels(name, _labels(labels), amount)
+
+    def inc_labels(self, name: str, labels: Labels, amount: float = 1) -> None:
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[labels] = series.get(labels, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels) -> None:
+        if self.enabled:
+            self.observe_labels(name, _labels(labels), seconds)
+
+    def observe_labels(self, name: str, labels: Labels, seconds: float) -> None:
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(labels)
+            if histogram is None:
+                histogram = series[labels] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name: str, **labels):
+        """Time a block of code into the ``name`` histogram.
+
+        Exceptions raised in the block are also counted in
+        ``<name>_errors_total``.
+        """
+        if not self.enabled:
+            return NULL_TIMER
+        return _Timer(self, name, _labels(labels))
+
+    def register(self, name: str, collector: Callable[[], Mapping[str, float]]) -> None:
+        """Add a source of gauges, read whenever metrics are reported.
+
+        ``collector`` returns a dict of gauge names to values; they are
+        reported as ``<name>_<gauge>``.
+        """
+        with self._lock:
+            self._collectors[name] = collector
+
+    def counters(self) -> Dict[str, Dict[Labels, float]]:
+        with self._lock:
+            return {name: dict(series) for name, series in self._counters.items()}
+
+    def histograms(self) -> Dict[str, Dict[Labels, Histogram]]:
+        with self._lock:
+            return {name: dict(series) for name, series in self._histograms.items()}
+
+    def gauges(self) -> Dict[str, float]:
+        with self._lock:
+            collectors = list(self._collectors.items())
+
+        gauges = {}
+        for name, collector in collectors:
+            for key, value in collector().items():
+                gauges["{}_{}".format(name, key)] = value
+        return gauges
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+
+        for name, series in sorted(self.counters().items()):
+            lines.append("# TYPE {}{} counter".format(PREFIX, name))
+            for labels, value in sorted(series.items()):
+                lines.append("{}{}{} {}".format(PREFIX, name, _format_labels(labels), value))
+
+        for name, hseries in sorted(self.histograms().items()):
+            metric = "{}{}_seconds".format(PREFIX, name)
+            lines.append("# TYPE {} histogram".format(metric))
+            for labels, histogram in sorted(hseries.items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append("{}_bucket{} {}".format(
+                        metric, _format_labels(labels + (("le", le),)), cumulative
+                    ))
+                lines.append("{}_sum{} {}".format(metric, _format_labels(labels), histogram.total))
+                lines.append("{}_count{} {}".format(metric, _format_labels(labels), histogram.count))
+
+        for name, value in sorted(self.gauges().items()):
+            lines.append("# TYPE {}{} gauge".format(PREFIX, name))
+            lines.append("{}{} {}".format(PREFIX, name, value))
+
+        return "\n".join(lines) + "\n"
+
+    def summary(self, name: str, by: Sequence[str] = ()) -> List[str]:
+        """Describe the latency of the ``name`` histogram in short lines for IRC.
+
+        Series are merged by the labels in ``by`` (into a single line if it is
+        empty), so that there is one line per e.g. operation rather than one
+        per host and operation; the busiest come first.
+        """
+        with self._lock:
+            merged: Dict[Labels, Histogram] = {}
+            for labels, histogram in self._histograms.get(name, {}).items():
+                key = tuple((label, value) for label, value in labels if label in by)
+                merged.setdefault(key, Histogram()).merge(histogram)
+
+        return [
+            "{}{}: n={} p50={:.0f}ms p99={:.0f}ms".format(
+                name,
+                _format_labels(labels),
+                histogram.count,
+                histogram.quantile(0.5) * 1000,
+                histogram.quantile(0.99) * 1000,
+            )
+            for labels, histogram in sorted(merged.items(), key=lambda item: -item[1].count)
+        ]
+
+
+def _format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join('{}="{}"'.format(key, value.replace('"', '\\"')) for key, value in labels) + "}"
+
+
+_metrics = Metrics()
+
+
+def get_metrics() -> Metrics:
+    """Get the shared registry."""
+    return _metrics
+
+
+def inc(name: str, amount: float = 1, **labels) -> None:
+    _metrics.inc(name, amount, **labels)
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    _metrics.observe(name, seconds, **labels)
+
+
+def timer(name: str, **labels):
+    return _metrics.timer(name, **labels)
+
+
+def timed(operation: str):
+    """Decorate a fetch function to time its calls into the ``fetch`` histogram.
+
+    The function's first argument must be the server it fetches from; calls
+    are labelled with it as ``host``, along with ``operation``.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(server, *args, **kwargs):
+            if not _metrics.enabled:
+                return function(server, *args, **kwargs)
+            with _Timer(_metrics, "fetch", _labels({"host": server, "operation": operation})):
+                return function(server, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def register(name: str, collector: Callable[[], Mapping[str, float]]) -> None:
+    _metrics.register(name, collector)
+
+
+def write_prometheus(path: str, registry: Optional[Metrics] = None) -> None:
+    """Atomically write the metrics in Prometheus text format to ``path``."""
+    text = (registry or _metrics).render_prometheus()
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".sopel-wikimedia-metrics")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as output:
+            output.write(text)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def configure(settings) -> None:
+    """Enable or disable metrics from the ``[wikipedia]`` config section."""
+    _metrics.enabled = settings.metrics
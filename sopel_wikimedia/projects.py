@@ -0,0 +1,161 @@
+"""Registry of the Wikimedia projects the plugins can look things up on.
+
+Each project describes where its wikis live, where their API is, and what
+can be looked up there. Host names are resolved to a :class:`Site` through
+:func:`lookup`, which also maps mobile hosts to their desktop equivalents, so
+that both share the same pooled connections and cache entries.
+"""
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import FrozenSet, Iterable, Mapping, NamedTuple, Optional, Tuple
+
+CAP_EXTRACTS = "extracts"
+"""Plain-text intro snippets of pages (the TextExtracts extension)."""
+CAP_SEARCH = "search"
+"""Full-text search."""
+CAP_SECTIONS = "sections"
+"""Section text through ``action=parse``."""
+CAP_FILES = "files"
+"""File pages are worth describing from their image metadata."""
+CAP_ENTITIES = "entities"
+"""Wikibase items, properties and lexemes."""
+CAP_DEFINITIONS = "definitions"
+"""Dictionary entries laid out the way the wiktionary plugin's parser expects."""
+
+
+class Project(NamedTuple):
+    name: str
+    domain: str
+    """Domain with one subdomain per language, or the single wiki's host name."""
+    multilingual: bool
+    capabilities: FrozenSet[str]
+    language_capabilities: Mapping[str, FrozenSet[str]] = {}
+    """Extra capabilities of some languages' wikis."""
+    aliases: Tuple[str, ...] = ()
+    """Other host names of a single-language project, e.g. its mobile site."""
+    api_path: str = "/w/api.php"
+    index_path: str = "/w/index.php"
+
+
+PROJECTS: Tuple[Project, ...] = (
+    Project(
+        "wikipedia",
+        "wikipedia.org",
+        True,
+        frozenset([CAP_EXTRACTS, CAP_SEARCH, CAP_SECTIONS]),
+    ),
+    Project(
+        "wiktionary",
+        "wiktionary.org",
+        True,
+        frozenset([CAP_EXTRACTS, CAP_SEARCH, CAP_SECTIONS]),
+        {"en": frozenset([CAP_DEFINITIONS])},
+    ),
+    Project(
+        "wikivoyage",
+        "wikivoyage.org",
+        True,
+        frozenset([CAP_EXTRACTS, CAP_SEARCH, CAP_SECTIONS]),
+    ),
+    Project(
+        "commons",
+        "commons.wikimedia.org",
+        False,
+        frozenset([CAP_EXTRACTS, CAP_SEARCH, CAP_SECTIONS, CAP_FILES]),
+        aliases=("commons.m.wikimedia.org",),
+    ),
+    Project(
+        "wikidata",
+        "www.wikidata.org",
+        False,
+        frozenset([CAP_SEARCH, CAP_ENTITIES]),
+        aliases=("m.wikidata.org", "wikidata.org"),
+    ),
+)
+PROJECTS_BY_NAME = {project.name: project for project in PROJECTS}
+
+R_LANG_HOST = re.compile(r"^(?!www\.)([a-z][a-z0-9-]*)(?:\.m)?\.([a-z.]+)$")
+"""Splits a multilingual project's host into its language and domain."""
+
+
+class Site(NamedTuple):
+    host: str
+    """Canonical (desktop) host name, e.g. ``en.wikipedia.org``."""
+    project: Project
+    lang: Optional[str]
+    """Language subdomain, or ``None`` for single-language projects."""
+
+    def has(self, capability: str) -> bool:
+        """Check whether things can be looked up on this wiki in some way."""
+        if capability in self.project.capabilities:
+            return True
+        extra = self.project.language_capabilities.get(self.lang or "", frozenset())
+        return capability in extra
+
+    @property
+    def capabilities(self) -> FrozenSet[str]:
+        """Everything that can be looked up on this wiki; see :meth:`has`."""
+        return self.project.capabilities | self.project.language_capabilities.get(self.lang or "", frozenset())
+
+    @property
+    def api_url(self) -> str:
+        return "https://" + self.host + self.project.api_path
+
+    @property
+    def index_url(self) -> str:
+        return "https://" + self.host + self.project.index_path
+
+
+@functools.lru_cache(maxsize=256)
+def lookup(host: str) -> Optional[Site]:
+    """Find which wiki ``host`` belongs to.
+
+    :return: the wiki, or ``None`` if ``host`` is not a known Wikimedia wiki
+    """
+    host = host.lower()
+    match = R_LANG_HOST.match(host)
+    for project in PROJECTS:
+        if project.multilingual:
+            if match is not None and match.group(2) == project.domain:
+                lang = match.group(1)
+                return Site("{}.{}".format(lang, project.domain), project, lang)
+        elif host == project.domain or host in project.aliases:
+            return Site(project.domain, project, None)
+    return None
+
+
+def site(name: str, lang: Optional[str] = None) -> Site:
+    """Get the wiki of project ``name`` in ``lang``.
+
+    :raise KeyError: if there is no such project
+    """
+    project = PROJECTS_BY_NAME[name]
+    if not project.multilingual:
+        return Site(project.domain, project, None)
+    return Site("{}.{}".format(lang, project.domain), project, lang)
+
+
+def api_url(host: str) -> str:
+    """Get the ``api.php`` URL of the wiki at ``host``."""
+    found = lookup(host)
+    return found.api_url if found is not None else "https://" + host + "/w/api.php"
+
+
+def index_url(host: str) -> str:
+    """Get the ``index.php`` URL of the wiki at ``host``."""
+    found = lookup(host)
+    return found.index_url if found is not None else "https://" + host + "/w/index.php"
+
+
+def host_pattern(projects: Iterable[Project] = PROJECTS) -> str:
+    """Get a regular expression matching the host name of any wiki of ``projects``."""
+    hosts = []
+    for project in projects:
+        if project.multilingual:
+            hosts.append(r"(?!www\.)[a-z][a-z0-9-]*(?:\.m)?\." + re.escape(project.domain))
+        else:
+            hosts.extend(re.escape(host) for host in (project.domain,) + project.aliases)
+    return "|".join(hosts)
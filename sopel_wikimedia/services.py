@@ -0,0 +1,63 @@
+"""Lifecycle of the resources shared by the Wikimedia plugins."""
+
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from sopel_wikimedia import (cache, client, engine, metrics, singleflight,
+                             workers)
+from sopel_wikimedia.diskcache import Compactor
+from sopel_wikimedia.wikipedia.config import WikipediaSection
+
+_users = 0
+_users_lock = threading.Lock()
+_compactor: Optional[Compactor] = None
+
+
+def setup(bot) -> None:
+    """Set up shared resources; call from every plugin's ``setup`` hook.
+
+    Both plugins read their shared settings from the ``[wikipedia]`` section.
+    """
+    global _users, _compactor
+
+    bot.config.define_section("wikipedia", WikipediaSection)
+    settings = bot.config.wikipedia
+
+    with _users_lock:
+        _users += 1
+        client.configure(settings)
+        cache.configure(settings)
+        engine.configure(settings)
+        engine.start()
+        workers.configure(settings)
+        metrics.configure(settings)
+        metrics.register("cache", cache.get_cache().stats)
+        metrics.register("singleflight", singleflight.get_flights().stats)
+        metrics.register("engine", lambda: {"pending": engine.get_engine().pending})
+        metrics.register("workers", workers.get_pool().stats)
+
+        backend = cache.get_cache().backend
+        if backend is not None and _compactor is None:
+            _compactor = Compactor(backend)
+            _compactor.start()
+
+
+def shutdown(bot) -> None:
+    """Release shared resources; call from every plugin's ``shutdown`` hook.
+
+    Resources are only torn down once the last plugin using them shuts down.
+    """
+    global _users, _compactor
+
+    with _users_lock:
+        _users = max(_users - 1, 0)
+        if not _users:
+            if _compactor is not None:
+                _compactor.stop()
+                _compactor = None
+            workers.close()
+            engine.close()
+            client.close()
+            cache.close()
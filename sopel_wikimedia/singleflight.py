@@ -0,0 +1,93 @@
+"""Coalescing of concurrent identical lookups.
+
+Sopel runs each callable in its own thread, so several users triggering the
+same lookup at once would otherwise each send the same request. Here, the
+first caller for a key does the work and everyone else waits for its result.
+"""
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class _Call:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Run at most one call per key at a time, sharing its outcome."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _Call] = {}
+        self.calls = 0
+        """How many calls were actually made."""
+        self.deduplicated = 0
+        """How many callers were given another caller's result instead."""
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        """Call ``fn``, unless a call for ``key`` is already in flight.
+
+        If one is, wait for it and return its result, or raise its exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                self.calls += 1
+                leader = True
+            else:
+                self.deduplicated += 1
+                leader = False
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as exc:
+            call.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+        return call.result
+
+    def is_running(self, key: Hashable) -> bool:
+        """Check whether a call for ``key`` is in flight."""
+        with self._lock:
+            return key in self._calls
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "deduplicated": self.deduplicated,
+                "in_flight": len(self._calls),
+            }
+
+
+_flights = SingleFlight()
+
+
+def get_flights() -> SingleFlight:
+    """Get the shared instance used by the fetch functions."""
+    return _flights
+
+
+def do(key: Hashable, fn: Callable[[], T]) -> T:
+    """Run ``fn`` through the shared instance."""
+    return _flights.do(key, fn)
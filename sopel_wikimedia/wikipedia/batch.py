@@ -0,0 +1,106 @@
+"""Coalescing of snippet lookups that arrive close together."""
+
+from __future__ import annotations
+
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_WINDOW = 0.05
+
+Fetcher = Callable[[str, List[str]], Dict[str, Optional[str]]]
+Peeker = Callable[[str, str], Tuple[bool, Optional[str]]]
+
+
+class _Pending:
+    __slots__ = ("event", "result", "error")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result: Optional[str] = None
+        self.error: Optional[BaseException] = None
+
+
+class SnippetBatcher:
+    """Collect snippet requests for a short window, then fetch them together.
+
+    Links in the same message (or in a burst of messages) are handled by
+    separate threads; each one calls :meth:`get` and blocks until the batch it
+    joined has been fetched with a single call to ``fetcher`` per server.
+
+    :param fetcher: function taking a server and a list of titles and
+                    returning a dict of titles to snippets, like
+                    :func:`~sopel_wikimedia.wikipedia.wiki.mw_snippets`
+    :param window: seconds to wait for more requests before fetching
+    :param peek: function taking a server and a title and returning a
+                 ``(found, snippet)`` tuple without making any request, like
+                 :func:`~sopel_wikimedia.wikipedia.wiki.cached_snippet`; found
+                 snippets are returned straight away, without joining a batch
+    """
+
+    def __init__(self, fetcher: Fetcher, window: float = DEFAULT_WINDOW, peek: Optional[Peeker] = None):
+        self.fetcher = fetcher
+        self.window = window
+        self.peek = peek
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple[str, str], _Pending] = {}
+        self._timer: Optional[threading.Timer] = None
+
+    def get(self, server: str, query: str) -> str:
+        """Get the snippet for ``query`` from ``server``.
+
+        :raise KeyError: if the page doesn't exist, like
+                         :func:`~sopel_wikimedia.wikipedia.wiki.mw_snippet`
+        """
+        if self.peek is not None:
+            found, snippet = self.peek(server, query)
+            if found:
+                return self._result(server, query, snippet)
+
+        if self.window <= 0:
+            return self._result(server, query, self.fetcher(server, [query]).get(query))
+
+        with self._lock:
+            pending = self._pending.get((server, query))
+            if pending is None:
+                pending = self._pending[(server, query)] = _Pending()
+            if self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+        pending.event.wait()
+        if pending.error is not None:
+            raise pending.error
+        return self._result(server, query, pending.result)
+
+    def _result(self, server: str, query: str, result: Optional[str]) -> str:
+        if result is None:
+            raise KeyError((server, query))
+        return result
+
+    def flush(self) -> None:
+        """Fetch everything requested so far and wake up the waiting threads."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._timer = None
+
+        by_server: Dict[str, Dict[str, _Pending]] = {}
+        for (server, query), waiter in pending.items():
+            by_server.setdefault(server, {})[query] = waiter
+
+        for server, waiters in by_server.items():
+            LOGGER.debug("Fetching %d snippet(s) from %s", len(waiters), server)
+            try:
+                results = self.fetcher(server, list(waiters))
+            except Exception as exc:
+                for waiter in waiters.values():
+                    waiter.error = exc
+                    waiter.event.set()
+                continue
+
+            for query, waiter in waiters.items():
+                waiter.result = results.get(query)
+                waiter.event.set()
@@ -8,3 +8,135 @@ from sopel.config import types
 class WikipediaSection(types.StaticSection):
     default_lang = types.ValidatedAttribute("default_lang", default="en")
     """The default language to find articles from (same as Wikipedia language subdomain)."""
+
+    http_pool_size = types.ValidatedAttribute("http_pool_size", int, default=10)
+    """How many keep-alive connections to pool for each Wikimedia host."""
+
+    http_connect_timeout = types.ValidatedAttribute("http_connect_timeout", float, default=5.0)
+    """Seconds to wait for a connection to a Wikimedia host to be established."""
+
+    http_read_timeout = types.ValidatedAttribute("http_read_timeout", float, default=15.0)
+    """Seconds to wait for a Wikimedia host to send its response."""
+
+    cache_max_entries = types.ValidatedAttribute("cache_max_entries", int, default=2048)
+    """Maximum number of API responses to keep in the in-memory cache."""
+
+    cache_max_bytes = types.ValidatedAttribute("cache_max_bytes", int, default=8 * 1024 * 1024)
+    """Approximate maximum size of the in-memory cache, in bytes."""
+
+    cache_ttls = types.ListAttribute("cache_ttls")
+    """Override how long cached responses are kept, as ``kind=seconds`` items.
+
+    Known kinds are ``snippet``, ``section``, ``sections`` (section indexes),
+    ``image``, ``search``, ``entity`` (Wikidata labels), and ``wiktionary``.
+    Setting a kind's TTL to ``0`` disables caching it.
+    """
+
+    cache_path = types.FilenameAttribute("cache_path")
+    """Optional SQLite file in which to persist cached responses across restarts.
+
+    Relative paths are resolved against the bot's home directory. Leave unset
+    to only cache responses in memory.
+    """
+
+    cache_max_disk_bytes = types.ValidatedAttribute("cache_max_disk_bytes", int, default=64 * 1024 * 1024)
+    """Compressed size the persistent cache is compacted down to, in bytes."""
+
+    batch_window = types.ValidatedAttribute("batch_window", float, default=0.05)
+    """Seconds to collect links before fetching their snippets in one request.
+
+    Set to ``0`` to fetch each link's snippet as soon as it is seen.
+    """
+
+    max_concurrency = types.ValidatedAttribute("max_concurrency", int, default=8)
+    """Maximum number of API lookups to run at the same time."""
+
+    max_host_concurrency = types.ValidatedAttribute("max_host_concurrency", int, default=4)
+    """Maximum number of API lookups to run at the same time against one host."""
+
+    html_engine = types.ChoiceAttribute("html_engine", choices=["auto", "html.parser", "lxml"], default="auto")
+    """Engine used to extract text from section and image description HTML.
+
+    ``lxml`` is much faster on long sections but needs the ``lxml`` package
+    (``pip install sopel-wikimedia[lxml]``); ``auto`` uses it when installed.
+    """
+
+    warmup_size = types.ValidatedAttribute("warmup_size", int, default=200)
+    """How many distinct linked articles to track the popularity of.
+
+    The most frequently linked ones have their snippets refreshed in the
+    background before they expire from the cache. Set to ``0`` to disable.
+    """
+
+    warmup_count = types.ValidatedAttribute("warmup_count", int, default=20)
+    """How many of the most frequently linked articles to keep cached."""
+
+    warmup_preload = types.ListAttribute("warmup_preload")
+    """Articles to fetch at startup and keep cached.
+
+    Items may be Wikipedia links, or titles on the ``default_lang`` Wikipedia.
+    """
+
+    cache_negative_ttl = types.ValidatedAttribute("cache_negative_ttl", float, default=60)
+    """Seconds to remember that a page, section, or definition doesn't exist."""
+
+    cache_stale_ttl = types.ValidatedAttribute("cache_stale_ttl", float, default=300)
+    """Seconds after expiring during which a cached response is still served.
+
+    The stale response is answered immediately while a fresh copy is fetched
+    in the background. Set to ``0`` to always wait for a fresh response.
+    """
+
+    rate_limit = types.ValidatedAttribute("rate_limit", float, default=10.0)
+    """Average number of requests per second to send to each Wikimedia host.
+
+    Set to ``0`` to disable rate limiting.
+    """
+
+    rate_burst = types.ValidatedAttribute("rate_burst", int, default=20)
+    """Number of requests that may be sent to a host at once, above ``rate_limit``."""
+
+    maxlag = types.ValidatedAttribute("maxlag", int, default=5)
+    """``maxlag`` value sent with API requests, in seconds; ``0`` to not send it.
+
+    See https://www.mediawiki.org/wiki/Manual:Maxlag_parameter
+    """
+
+    max_retries = types.ValidatedAttribute("max_retries", int, default=3)
+    """How many times to retry a request the server asked us to slow down for."""
+
+    max_backoff = types.ValidatedAttribute("max_backoff", float, default=30.0)
+    """Longest time to wait before retrying a request, in seconds."""
+
+    search_snippets = types.BooleanAttribute("search_snippets", default=True)
+    """Whether ``.wp`` fetches the top search result's snippet with the search.
+
+    This makes a search and its snippet a single request, or none at all when
+    the query was searched recently. Disable to search with ``list=search``.
+    """
+
+    metrics = types.BooleanAttribute("metrics", default=True)
+    """Whether to record request counts and latencies, shown by ``.wpstats``."""
+
+    metrics_file = types.FilenameAttribute("metrics_file")
+    """Optional file to write metrics to every minute, in Prometheus text format.
+
+    Point node_exporter's textfile collector at it to scrape the bot's metrics.
+    Relative paths are resolved against the bot's home directory.
+    """
+
+    lookup_workers = types.ValidatedAttribute("lookup_workers", int, default=8)
+    """How many link and command lookups to handle at the same time.
+
+    Lookups beyond this wait in a queue, from which each channel gets a turn
+    in rotation.
+    """
+
+    lookup_queue_size = types.ValidatedAttribute("lookup_queue_size", int, default=64)
+    """How many lookups may wait in the queue; more are dropped."""
+
+    lookup_channel_queue_size = types.ValidatedAttribute("lookup_channel_queue_size", int, default=8)
+    """How many lookups may wait in the queue for any one channel; more are dropped."""
+
+    lookup_deadline = types.ValidatedAttribute("lookup_deadline", float, default=30.0)
+    """Seconds after which a lookup still waiting in the queue is dropped."""
@@ -0,0 +1,170 @@
+"""Engines for extracting IRC-friendly text from section and image HTML.
+
+The pure-Python :class:`HTMLParserExtractor` always works. If ``lxml`` is
+installed, :class:`LxmlExtractor` tokenizes the HTML in C instead, which is much
+faster on the long sections ``action=parse`` can return. Both apply the same
+:class:`~.parser.WikiParser` rules to decide what text to keep, so they produce
+the same output, and both stop reading once a budget of text is reached.
+"""
+
+from __future__ import annotations
+
+import abc
+import itertools
+import logging
+from typing import Dict, Optional, Type
+
+from .parser import WikiParser, extract_text
+
+CHUNK_SIZE = 4096
+"""Characters of HTML to feed at a time when extracting with a budget."""
+
+LOGGER = logging.getLogger(__name__)
+
+try:
+    import lxml.etree  # type: ignore[import-untyped]
+    import lxml.html  # type: ignore[import-untyped]
+except ImportError:
+    lxml = None
+
+
+class Extractor(abc.ABC):
+    """Base class for text extraction engines."""
+
+    name = ""
+
+    @abc.abstractmethod
+    def extract(self, html: str, section_name: str, budget: Optional[int] = None) -> str:
+        """Get the visible text of ``html``, with whitespace collapsed.
+
+        :param section_name: heading text to leave out of the result
+        :param budget: stop after about this many characters of text
+        """
+
+
+class HTMLParserExtractor(Extractor):
+    """Extract text with :mod:`html.parser`; always available."""
+
+    name = "html.parser"
+
+    def extract(self, html: str, section_name: str, budget: Optional[int] = None) -> str:
+        return extract_text(html, section_name, budget)
+
+
+class LxmlExtractor(Extractor):
+    """Extract text from a tree built by ``lxml``.
+
+    The tree is walked in document order, replaying its tags and text into a
+    :class:`~.parser.WikiParser` so the same skip rules apply. With a budget,
+    the HTML is fed to the parser in chunks instead, and replayed as it is
+    parsed, so that parsing stops once the budget is reached.
+    """
+
+    name = "lxml"
+
+    def __init__(self):
+        if lxml is None:
+            raise ImportError("The lxml extraction engine requires lxml to be installed")
+
+    def extract(self, html: str, section_name: str, budget: Optional[int] = None) -> str:
+        parser = WikiParser(section_name, budget)
+        if html.strip():
+            if budget is None:
+                root = lxml.html.fragment_fromstring(html, create_parent="div")
+                self._walk(root, parser)
+            else:
+                self._pull(html, parser)
+
+        return " ".join(parser.get_result().split())  # collapse multiple whitespace chars
+
+    def _walk(self, root, parser: WikiParser) -> None:
+        for event, element in lxml.etree.iterwalk(root, events=("start", "end")):
+            if parser.done:
+                break
+
+            # comments and processing instructions only contribute their tail
+            is_tag = isinstance(element.tag, str)
+
+            if event == "start":
+                if element is root:
+                    if root.text:
+                        parser.handle_data(root.text)
+                elif is_tag:
+                    parser.handle_starttag(element.tag, element.items())
+                    if element.text:
+                        parser.handle_data(element.text)
+            elif element is not root:
+                if is_tag:
+                    parser.handle_endtag(element.tag)
+                if element.tail:
+                    parser.handle_data(element.tail)
+
+    def _pull(self, html: str, parser: WikiParser) -> None:
+        wrapper = None
+        # an element's text (or tail) is only complete once the parser has
+        # moved on to the next event, so it is replayed then
+        pending = None
+
+        for event, element in self._events(html):
+            if pending is not None:
+                data = getattr(*pending)
+                if data:
+                    parser.handle_data(data)
+                pending = None
+            if parser.done:
+                return
+
+            if event in ("comment", "pi"):
+                pending = (element, "tail")
+            elif element.tag in ("html", "body"):
+                continue
+            elif wrapper is None:
+                wrapper = element
+                pending = (element, "text")
+            elif element is wrapper:
+                return  # end of the wrapper
+            elif event == "start":
+                parser.handle_starttag(element.tag, element.items())
+                pending = (element, "text")
+            else:
+                parser.handle_endtag(element.tag)
+                pending = (element, "tail")
+
+        if pending is not None and getattr(*pending):
+            parser.handle_data(getattr(*pending))
+
+    @staticmethod
+    def _events(html: str):
+        pull = lxml.etree.HTMLPullParser(events=("start", "end", "comment", "pi"))
+        # the same wrapper as fragment_fromstring(), so that both build the
+        # same tree; the implied <html> and <body> around it are not replayed
+        chunks = (html[start:start + CHUNK_SIZE] for start in range(0, len(html), CHUNK_SIZE))
+        for chunk in itertools.chain(["<div>"], chunks, ["</div>"]):
+            pull.feed(chunk)
+            yield from pull.read_events()
+        # whatever the parser still holds back, e.g. after truncated markup
+        pull.close()
+        yield from pull.read_events()
+
+
+EXTRACTORS: Dict[str, Type[Extractor]] = {
+    HTMLParserExtractor.name: HTMLParserExtractor,
+    LxmlExtractor.name: LxmlExtractor,
+}
+
+
+def get_extractor(name: str = "auto") -> Extractor:
+    """Get an extraction engine by name.
+
+    ``auto`` picks ``lxml`` if it is installed, and ``html.parser`` otherwise.
+
+    :raise ValueError: if there is no engine with that name
+    :raise ImportError: if the engine's dependencies are not installed
+    """
+    if name == "auto":
+        name = LxmlExtractor.name if lxml is not None else HTMLParserExtractor.name
+
+    try:
+        return EXTRACTORS[name]()
+    except KeyError:
+        raise ValueError("Unknown HTML extraction engine: {!r}".format(name))
@@ -1,16 +1,30 @@
-import re
 from html.parser import HTMLParser
 
+HEADER_TAGS = frozenset("h{}".format(level) for level in range(1, 7))
+
+SKIPPED_DIV_CLASSES = frozenset(["thumb", "hatnote"])
+"""Classes of ``<div>`` elements whose contents should be skipped.
+
+These are thumbnail text and section "hatnotes".
+"""
+
+
+def _get_class(attrs):
+    for name, value in attrs:
+        if name == "class":
+            return value or ""
+    return ""
+
 
 class WikiParser(HTMLParser):
-    NO_CONSUME_TAGS = ("sup", "style")
+    NO_CONSUME_TAGS = frozenset(["sup", "style"])
     """Tags whose contents should always be ignored.
 
     These are used in things like inline citations or section "hatnotes", none
     of which are useful output for IRC.
     """
 
-    def __init__(self, section_name):
+    def __init__(self, section_name, budget=None):
         HTMLParser.__init__(self)
         self.consume = True
         self.no_consume_depth = 0
@@ -22,23 +36,26 @@ class WikiParser(HTMLParser):
         self.span_depth = 0
         self.div_depth = 0
 
-        self.result = ""
+        self.result = []
+        self.budget = budget
+        """Stop collecting text once about this many characters are visible."""
+        self.length = 0
+        self.done = False
 
     def handle_starttag(self, tag, attrs):
         if tag in self.NO_CONSUME_TAGS:
             self.consume = False
             self.no_consume_depth += 1
 
-        elif re.match(r"^h\d$", tag):
+        elif tag in HEADER_TAGS:
             self.is_header = True
 
         elif tag == "span":
             if self.span_depth:
                 self.span_depth += 1
-            else:
-                for attr in attrs:  # remove 'edit' tags, and keep track of depth for nested <span> tags
-                    if attr[0] == "class" and "edit" in attr[1]:
-                        self.span_depth += 1
+            elif "edit" in _get_class(attrs):
+                # remove 'edit' tags, and keep track of depth for nested <span> tags
+                self.span_depth += 1
 
         elif tag == "div":
             # We want to skip thumbnail text, the table of contents, and section "hatnotes".
@@ -46,39 +63,21 @@ class WikiParser(HTMLParser):
             if self.div_depth:
                 self.div_depth += 1
             else:
-                for attr in attrs:
-                    if attr[0] == "class" and (
-                        "thumb" in attr[1]
-                        or "hatnote" in attr[1]
-                        or attr[1] == "toc"
-                    ):
-                        self.div_depth += 1
-                        break
+                classes = _get_class(attrs)
+                if classes == "toc" or not SKIPPED_DIV_CLASSES.isdisjoint(classes.split()):
+                    self.div_depth += 1
 
         elif tag == "table":
-            # Message box templates are what we want to ignore here
-            for attr in attrs:
-                if attr[0] == "class" and any(
-                    classname in attr[1].lower()
-                    for classname in [
-                        # Most of list from https://en.wikipedia.org/wiki/Template:Mbox_templates_see_also
-                        "ambox",  # messageboxes on article pages
-                        "cmbox",  # messageboxes on category pages
-                        "imbox",  # messageboxes on file (image) pages
-                        "tmbox",  # messageboxes on talk pages
-                        "fmbox",  # header and footer messageboxes
-                        "ombox",  # messageboxes on other types of page
-                        "mbox",  # for messageboxes that are used in different namespaces
-                                 # and change their presentation accordingly
-                        "dmbox",  # for disambiguation messageboxes
-                    ]
-                ):
-                    self.messagebox = True
+            # Message box templates are what we want to ignore here. All of their
+            # classes (ambox, cmbox, imbox, tmbox, fmbox, ombox, dmbox, and plain
+            # mbox; see https://en.wikipedia.org/wiki/Template:Mbox_templates_see_also)
+            # contain "mbox".
+            if "mbox" in _get_class(attrs).lower():
+                self.messagebox = True
 
         elif tag == "ol":
-            for attr in attrs:
-                if attr[0] == "class" and "references" in attr[1]:
-                    self.citations = True  # once we hit citations, we can stop
+            if "references" in _get_class(attrs):
+                self.citations = True  # once we hit citations, we can stop
 
     def handle_endtag(self, tag):
         if not self.consume and tag in self.NO_CONSUME_TAGS:
@@ -86,7 +85,7 @@ class WikiParser(HTMLParser):
                 self.no_consume_depth -= 1
             if not self.no_consume_depth:
                 self.consume = True
-        if self.is_header and re.match(r"^h\d$", tag):
+        if self.is_header and tag in HEADER_TAGS:
             self.is_header = False
         if self.span_depth and tag == "span":
             self.span_depth -= 1
@@ -96,10 +95,42 @@ class WikiParser(HTMLParser):
             self.messagebox = False
 
     def handle_data(self, data):
-        if self.consume and not any([self.citations, self.messagebox, self.span_depth, self.div_depth]):
+        if (
+            not self.done
+            and self.consume
+            and not self.citations
+            and not self.messagebox
+            and not self.span_depth
+            and not self.div_depth
+        ):
             # Skip the initial header info only
-            if not self.is_header and data == self.section_name:
-                self.result += data
+            if not (self.is_header and data == self.section_name):
+                self.result.append(data)
+                if self.budget is not None:
+                    # count text as it will look once whitespace is collapsed
+                    self.length += len(" ".join(data.split()))
+                    if data[:1].isspace() or data[-1:].isspace():
+                        self.length += 1
+                    self.done = self.length >= self.budget
 
     def get_result(self):
-        return self.result
+        return "".join(self.result)
+
+
+def extract_text(html, section_name, budget=None, chunk_size=4096):
+    """Get the visible text of ``html``, with whitespace collapsed.
+
+    If a ``budget`` is given, the HTML is parsed in chunks of ``chunk_size``
+    characters and parsing stops once about ``budget`` characters of text have
+    been found, so only as much HTML is parsed as can be shown.
+    """
+    parser = WikiParser(section_name, budget)
+    if budget is None:
+        parser.feed(html)
+    else:
+        for start in range(0, len(html), chunk_size):
+            parser.feed(html[start:start + chunk_size])
+            if parser.done:
+                break
+
+    return " ".join(parser.get_result().split())  # collapse multiple whitespace chars
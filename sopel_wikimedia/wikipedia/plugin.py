@@ -8,22 +8,145 @@ https://sopel.chat
 
 from __future__ import annotations
 
+import functools
 import logging
-import re
-from urllib.parse import quote, unquote, urlparse
+from urllib.parse import quote
 
 from sopel import plugin
 
+from sopel_wikimedia import (cache, engine, irc, metrics, projects, services,
+                             workers)
+from sopel_wikimedia.wiktionary.impl import format_wikt
+
+from . import urls, wiki
+from .batch import SnippetBatcher
 from .config import WikipediaSection
-from .wiki import mw_image_description, mw_search, mw_section, mw_snippet
+from .prefs import LanguagePreferences
+from .warmup import HotSet
 
 LOGGER = logging.getLogger(__name__)
 
 PLUGIN_OUTPUT_PREFIX = "[wikipedia] "
 
+TEXT_BUDGET = 512
+"""Characters of section or image description text to extract.
+
+No IRC message can show more than this, so there is no point parsing further.
+"""
+
+SNIPPET_CHARS_STEP = 50
+"""Snippet sizes are rounded up to a multiple of this many characters."""
+
+WARMUP_INTERVAL = 60
+"""Seconds between checks for popular articles whose snippets need refreshing."""
+WARMUP_DECAY_TICKS = 60
+"""Halve link counts every this many checks, so popularity fades over time."""
+METRICS_INTERVAL = 60
+"""Seconds between writes of the ``metrics_file``."""
+WPSTATS_MAX_LINES = 8
+"""Most lines of fetch latencies ``.wpstats`` says; one per operation."""
+
+BATCHER = SnippetBatcher(functools.partial(engine.call, "mw_snippets"), peek=wiki.cached_snippet)
+LANGUAGES = LanguagePreferences()
+HOT_LINKS = HotSet()
+PRELOAD: list[tuple[str, str]] = []
+_snippet_chars = 0
+_warmup_ticks = 0
+
 
 def setup(bot):
-    bot.config.define_section("wikipedia", WikipediaSection)
+    services.setup(bot)
+    settings = bot.config.wikipedia
+    wiki.configure(settings)
+    BATCHER.window = settings.batch_window
+    HOT_LINKS.capacity = settings.warmup_size
+
+    PRELOAD[:] = [
+        preload_target(item, settings.default_lang)
+        for item in settings.warmup_preload
+    ]
+    if PRELOAD:
+        LOGGER.debug("Preloading %d article(s)", len(PRELOAD))
+        refresh_snippets(PRELOAD)
+
+
+def shutdown(bot):
+    LANGUAGES.clear()
+    HOT_LINKS.clear()
+    services.shutdown(bot)
+
+
+def preload_target(item, default_lang):
+    """Get the ``(server, query)`` to preload for a ``warmup_preload`` item."""
+    if urls.R_URL.match(item):
+        link = urls.resolve_url(item)
+        return link.server, quote(link.title.replace(" ", "_"))
+    return projects.site("wikipedia", default_lang).host, quote(item.replace(" ", "_"))
+
+
+def refresh_snippets(targets):
+    """Fetch the snippets of ``(server, query)`` pairs in the background."""
+    by_server = {}
+    for server, query in targets:
+        by_server.setdefault(server, []).append(query)
+
+    for server, queries in by_server.items():
+        future = engine.submit("mw_snippets", server, queries, True)
+        future.add_done_callback(functools.partial(log_refresh_error, server))
+
+
+def log_refresh_error(server, future):
+    """Log why a background snippet refresh failed, since nobody waits for it."""
+    if future.cancelled():
+        return
+    error = future.exception()
+    if error is not None:
+        LOGGER.error(
+            "Error refreshing snippets from %s",
+            server,
+            exc_info=(type(error), error, error.__traceback__),
+        )
+
+
+@plugin.interval(WARMUP_INTERVAL)
+def warm_up(bot):
+    """Refresh popular articles' snippets before they expire from the cache."""
+    global _warmup_ticks
+
+    _warmup_ticks += 1
+    if _warmup_ticks % WARMUP_DECAY_TICKS == 0:
+        HOT_LINKS.decay()
+
+    targets = PRELOAD + [
+        key for key, _count in HOT_LINKS.top(bot.config.wikipedia.warmup_count)
+    ]
+    stale = []
+    for server, query in targets:
+        key = cache.make_key("snippet", server, query)
+        state, snippet = cache.get_cache().lookup(key, count=False)
+        if state == cache.FRESH and snippet is None:
+            continue  # page is known not to exist
+
+        remaining = cache.get_cache().remaining(key)
+        if remaining is None or remaining < 2 * WARMUP_INTERVAL:
+            stale.append((server, query))
+
+    if stale:
+        LOGGER.debug("Refreshing %d popular article(s)", len(stale))
+        refresh_snippets(stale)
+
+
+@plugin.interval(METRICS_INTERVAL)
+def write_metrics(bot):
+    """Dump metrics to the ``metrics_file``, if one is configured."""
+    path = bot.config.wikipedia.metrics_file
+    if not path or not metrics.get_metrics().enabled:
+        return
+
+    try:
+        metrics.write_prometheus(path)
+    except OSError:
+        LOGGER.exception("Couldn't write metrics to %r", path)
 
 
 def configure(config):
@@ -33,39 +156,37 @@ def configure(config):
     )
 
 
-# Matches a Wikipedia link (excluding /File: pages)
-@plugin.url(r"https?:\/\/([a-z]+(?:\.m)?\.wikipedia\.org)\/wiki\/((?!File\:)[^ ]+)")
+@plugin.url(urls.URL_PATTERN)
 @plugin.output_prefix(PLUGIN_OUTPUT_PREFIX)
 def mw_info(bot, trigger, match=None):
-    """Retrieves and outputs a snippet of the linked page."""
-    server = match.group(1)
-    page_info = urlparse(match.group(0))
-    # in Python 3.9+ this can be str.removeprefix() instead, but we're confident that
-    # "/wiki/" is at the start of the path anyway since it's part of the pattern
-    trim_offset = len("/wiki/")
-    article = unquote(page_info.path)[trim_offset:]
-    section = unquote(page_info.fragment)
-
-    if article.startswith("Special:"):
-        # The MediaWiki query API does not include pages in the Special:
-        # namespace, so there's no point bothering when we know this will error
+    """Retrieves and outputs a snippet of the linked page.
+
+    Links to any wiki in the project registry are handled, each in the way its
+    capabilities allow; see :func:`~sopel_wikimedia.wikipedia.urls.resolve_url`.
+    """
+    link = urls.resolve_url(match.group(0))
+
+    if link.kind == urls.KIND_SPECIAL:
         LOGGER.debug("Ignoring page in Special: namespace")
         return False
 
-    if section:
-        if section.startswith("cite_note-"):
-            # Don't bother trying to retrieve a section snippet if cite-note is linked
-            say_snippet(bot, trigger, server, article, show_url=False)
-        elif section.startswith("/media"):
-            # gh2316: media fragments are usually images; try to get an image description
-            image = section[
-                7:
-            ]  # strip '/media' prefix in pre-3.9 friendly way
-            say_image_description(bot, trigger, server, image)
-        else:
-            say_section(bot, trigger, server, article, section)
+    # nobody asked for this one, so when the bot is busy it is simply skipped
+    if workers.submit(trigger.sender, say_link, bot, trigger, link) is None:
+        LOGGER.debug("Too busy; not looking up %s", match.group(0))
+
+
+@irc.replies_on_error("Error fetching that link.", reply=False)
+def say_link(bot, trigger, link):
+    if link.kind == urls.KIND_IMAGE:
+        say_image_description(bot, trigger, link.server, link.title)
+    elif link.kind == urls.KIND_SECTION:
+        say_section(bot, trigger, link.server, link.title, link.fragment)
+    elif link.kind == urls.KIND_ENTITY:
+        say_entity(bot, trigger, link.server, link.title)
+    elif link.kind == urls.KIND_DEFINITION:
+        say_definition(bot, trigger, link.server, link.title)
     else:
-        say_snippet(bot, trigger, server, article, show_url=False)
+        say_snippet(bot, trigger, link.server, link.title, show_url=False)
 
 
 @plugin.command("wikipedia", "wp")
@@ -79,7 +200,7 @@ def wikipedia(bot, trigger):
 
     lang = choose_lang(bot, trigger)
     query = trigger.group(2)
-    args = re.search(r"^-([a-z]{2,12})\s(.*)", query)
+    args = urls.R_LANG_ARG.search(query)
     if args is not None:
         lang = args.group(1)
         query = args.group(2)
@@ -94,13 +215,24 @@ def wikipedia(bot, trigger):
         )
         return False
 
-    server = lang + ".wikipedia.org"
-    query = mw_search(server, query, 1)
+    server = projects.site("wikipedia", lang).host
+    future = workers.submit(trigger.sender, say_search, bot, trigger, server, query)
+    return irc.wait_for(bot, future, dropped=plugin.NOLIMIT)
+
+
+@irc.replies_on_error("Error searching Wikipedia.")
+def say_search(bot, trigger, server, query):
+    if bot.config.wikipedia.search_snippets:
+        # sized before searching, since the top result's snippet comes along
+        fit_snippets(bot, trigger.sender)
+        query = engine.call("mw_search_snippet", server, query)
+    else:
+        results = engine.call("mw_search", server, query, 1)
+        query = results[0] if results else None
+
     if not query:
         bot.reply("I can't find any results for that.")
         return plugin.NOLIMIT
-    else:
-        query = query[0]
     say_snippet(bot, trigger, server, query, commanded=True)
 
 
@@ -110,16 +242,13 @@ def wplang(bot, trigger):
     if not trigger.group(3):
         bot.reply(
             "Your current Wikipedia language is: {}".format(
-                bot.db.get_nick_value(
-                    trigger.nick,
-                    "wikipedia_lang",
-                    bot.config.wikipedia.default_lang,
-                )
+                LANGUAGES.get_nick(bot.db, trigger.nick)
+                or bot.config.wikipedia.default_lang
             )
         )
         return
 
-    bot.db.set_nick_value(trigger.nick, "wikipedia_lang", trigger.group(3))
+    LANGUAGES.set_nick(bot.db, trigger.nick, trigger.group(3))
     bot.reply("Set your Wikipedia language to: {}".format(trigger.group(3)))
 
 
@@ -139,18 +268,13 @@ def wpclang(bot, trigger):
         bot.say(
             "{}'s current Wikipedia language is: {}".format(
                 trigger.sender,
-                bot.db.get_nick_value(
-                    trigger.nick,
-                    "wikipedia_lang",
-                    bot.config.wikipedia.default_lang,
-                ),
+                LANGUAGES.get_channel(bot.db, trigger.sender)
+                or bot.config.wikipedia.default_lang,
             )
         )
         return
 
-    bot.db.set_channel_value(
-        trigger.sender, "wikipedia_lang", trigger.group(3)
-    )
+    LANGUAGES.set_channel(bot.db, trigger.sender, trigger.group(3))
     bot.say(
         "Set {}'s Wikipedia language to: {}".format(
             trigger.sender, trigger.group(3)
@@ -160,14 +284,12 @@ def wpclang(bot, trigger):
 
 def choose_lang(bot, trigger):
     """Determine what language to use for queries based on sender/context."""
-    user_lang = bot.db.get_nick_value(trigger.nick, "wikipedia_lang")
+    user_lang = LANGUAGES.get_nick(bot.db, trigger.nick)
     if user_lang:
         return user_lang
 
     if not trigger.sender.is_nick():
-        channel_lang = bot.db.get_channel_value(
-            trigger.sender, "wikipedia_lang"
-        )
+        channel_lang = LANGUAGES.get_channel(bot.db, trigger.sender)
         if channel_lang:
             return channel_lang
 
@@ -185,11 +307,15 @@ def say_snippet(bot, trigger, server, query, show_url=True, commanded=False):
     ):
         return
 
+    if not commanded:
+        HOT_LINKS.add((server, query))
+
+    fit_snippets(bot, trigger.sender)
     try:
-        snippet = mw_snippet(server, query)
+        snippet = BATCHER.get(server, query)
         # Coalesce repeated whitespace to avoid problems with <math> on MediaWiki
         # see https://github.com/sopel-irc/sopel/issues/2259
-        snippet = re.sub(r"\s+", " ", snippet)
+        snippet = urls.R_WHITESPACE.sub(" ", snippet)
     except KeyError:
         msg = 'Error fetching snippet for "{}".'.format(page_name)
         if commanded:
@@ -207,11 +333,34 @@ def say_snippet(bot, trigger, server, query, show_url=True, commanded=False):
     bot.say(msg, truncation=" […]", trailing=trailing)
 
 
+def fit_snippets(bot, recipient):
+    """Size snippet requests to what a message to ``recipient`` can show.
+
+    Snippets are cached and shared between channels, so requests are sized for
+    the roomiest recipient seen so far. The bot's byte budget is used as the
+    character count, which is enough whatever the text's encoded length.
+    """
+    global _snippet_chars
+
+    available = irc.text_length(bot, recipient) - len(PLUGIN_OUTPUT_PREFIX) - len(' | ""')
+    chars = -(-available // SNIPPET_CHARS_STEP) * SNIPPET_CHARS_STEP
+    if chars > _snippet_chars:
+        _snippet_chars = chars
+        wiki.snippet_chars = min(chars, wiki.MAX_SNIPPET_CHARS)
+
+
 def say_section(bot, trigger, server, query, section):
     page_name = query.replace("_", " ")
     query = quote(query.replace(" ", "_"))
 
-    snippet = mw_section(server, query, section)
+    # Checking the (cached) section index first means links to sections that
+    # don't exist never cost a request for the section text
+    snippet = None
+    if engine.call("mw_find_section", server, query, section) is not None:
+        snippet = engine.call(
+            "mw_section", server, query, section, TEXT_BUDGET
+        )
+
     if not snippet:
         bot.say(
             'Error fetching section "{}" for page "{}".'.format(
@@ -226,8 +375,71 @@ def say_section(bot, trigger, server, query, section):
     bot.say(msg, truncation=' […]"')
 
 
+def say_entity(bot, trigger, server, entity):
+    desc = engine.call("mw_entity", server, entity, choose_lang(bot, trigger))
+
+    if desc:
+        bot.say("{}: {}".format(entity, desc), truncation=" […]")
+
+
+def say_definition(bot, trigger, server, word):
+    entry = engine.call("wikt", server, word.replace("_", " "))
+
+    if not entry.parts:
+        # not laid out like an entry we can parse; the intro may still do
+        say_snippet(bot, trigger, server, word, show_url=False)
+        return
+
+    max_length = irc.text_length(bot, trigger.sender) - len(PLUGIN_OUTPUT_PREFIX)
+    bot.say(format_wikt(word.replace("_", " "), entry, max_length=max_length), truncation=" […]")
+
+
 def say_image_description(bot, trigger, server, image):
-    desc = mw_image_description(server, image)
+    desc = engine.call(
+        "mw_image_description", server, image, TEXT_BUDGET
+    )
 
     if desc:
         bot.say(desc, truncation=" […]")
+
+
+@plugin.command("wpstats")
+@plugin.require_admin()
+@plugin.output_prefix(PLUGIN_OUTPUT_PREFIX)
+def wpstats(bot, trigger):
+    """Show lookup latencies and cache statistics (admin only)."""
+    registry = metrics.get_metrics()
+    if not registry.enabled:
+        bot.reply("Metrics are disabled; set metrics = true in the [wikipedia] section.")
+        return
+
+    stats = cache.get_cache().stats()
+    bot.say(
+        "cache: {entries} entries, {bytes} bytes, hit ratio {hit_ratio:.0%} "
+        "({hits} hits, {stale_hits} stale, {misses} misses, {evictions} evicted)".format(**stats)
+    )
+
+    lookups = registry.counters().get("cache_lookups_total", {})
+    by_kind = {}
+    for labels, count in lookups.items():
+        labels = dict(labels)
+        total, hits = by_kind.get(labels["kind"], (0, 0))
+        by_kind[labels["kind"]] = (total + count, hits + (count if labels["result"] != cache.MISS else 0))
+    if by_kind:
+        bot.say("hit ratio by kind: " + ", ".join(
+            "{} {:.0%}".format(kind, hits / total) for kind, (total, hits) in sorted(by_kind.items())
+        ))
+
+    bot.say(
+        "lookups: {queued} queued, {running} running, {completed} done; "
+        "dropped {shed_full} (queue full), {shed_expired} (waited too long)".format(
+            **workers.get_pool().stats()
+        )
+    )
+
+    lines = registry.summary("fetch", by=("operation",))
+    if len(lines) > WPSTATS_MAX_LINES:
+        more = len(lines) - WPSTATS_MAX_LINES + 1
+        lines = lines[:WPSTATS_MAX_LINES - 1] + ["...and {} more operations".format(more)]
+    for line in lines or ["no lookups yet"]:
+        bot.say(line)
@@ -0,0 +1,59 @@
+"""In-memory cache of users' and channels' Wikipedia language preferences."""
+
+from __future__ import annotations
+
+import threading
+from typing import Dict, Optional
+
+PREFERENCE_KEY = "wikipedia_lang"
+
+
+class LanguagePreferences:
+    """Write-through cache of the ``wikipedia_lang`` database values.
+
+    Values are read from the bot's database the first time a nick or channel
+    is looked up (including when it has no preference) and kept in memory
+    after that. Setting a preference through this class updates both.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._nicks: Dict[str, Optional[str]] = {}
+        self._channels: Dict[str, Optional[str]] = {}
+
+    def get_nick(self, db, nick) -> Optional[str]:
+        key = nick.lower()
+        try:
+            return self._nicks[key]
+        except KeyError:
+            pass
+
+        value = db.get_nick_value(nick, PREFERENCE_KEY)
+        with self._lock:
+            return self._nicks.setdefault(key, value)
+
+    def get_channel(self, db, channel) -> Optional[str]:
+        key = channel.lower()
+        try:
+            return self._channels[key]
+        except KeyError:
+            pass
+
+        value = db.get_channel_value(channel, PREFERENCE_KEY)
+        with self._lock:
+            return self._channels.setdefault(key, value)
+
+    def set_nick(self, db, nick, lang: str) -> None:
+        with self._lock:
+            db.set_nick_value(nick, PREFERENCE_KEY, lang)
+            self._nicks[nick.lower()] = lang
+
+    def set_channel(self, db, channel, lang: str) -> None:
+        with self._lock:
+            db.set_channel_value(channel, PREFERENCE_KEY, lang)
+            self._channels[channel.lower()] = lang
+
+    def clear(self) -> None:
+        with self._lock:
+            self._nicks.clear()
+            self._channels.clear()
@@ -0,0 +1,139 @@
+"""Resolution of Wikimedia links into what should be looked up."""
+
+from __future__ import annotations
+
+import functools
+import re
+from typing import FrozenSet, NamedTuple, Optional, Tuple
+from urllib.parse import unquote, urlsplit
+
+from sopel_wikimedia import projects
+
+ENTITY_ID = r"[QP][1-9][0-9]*"
+"""Id of a Wikibase item or property; lexemes have no labels to show."""
+R_ENTITY_TITLE = re.compile(r"^(?:Property:)?({})$".format(ENTITY_ID))
+"""Matches the page title of a Wikibase entity, capturing its id."""
+
+
+def _url_pattern() -> str:
+    # Links that can't be looked up are left out of the pattern rather than
+    # ignored by the callable, so that Sopel's url plugin still shows their
+    # page title: Special: pages, File: pages on wikis without file
+    # descriptions, and anything but entities on Wikibase wikis.
+    no_files = projects.host_pattern(
+        project for project in projects.PROJECTS
+        if projects.CAP_FILES not in project.capabilities
+    )
+    entities = projects.host_pattern(
+        project for project in projects.PROJECTS
+        if projects.CAP_ENTITIES in project.capabilities
+    )
+    return (
+        r"https?:\/\/"
+        r"(?!(?:{no_files})\/wiki\/File:)"
+        r"(?!(?:{entities})\/wiki\/(?!(?:Property:)?{entity}(?![^\s#?])))"
+        r"({hosts})\/wiki\/((?!Special:)[^ ]+)"
+    ).format(
+        no_files=no_files,
+        entities=entities,
+        entity=ENTITY_ID,
+        hosts=projects.host_pattern(),
+    )
+
+
+URL_PATTERN = _url_pattern()
+"""Matches a link to a page on any wiki in :data:`~sopel_wikimedia.projects.PROJECTS`
+that something can be looked up for."""
+R_URL = re.compile(URL_PATTERN)
+R_WHITESPACE = re.compile(r"\s+")
+R_LANG_ARG = re.compile(r"^-([a-z]{2,12})\s(.*)")
+
+# in Python 3.9+ this could use str.removeprefix() instead, but we're confident
+# these are at the start since they're part of the pattern
+WIKI_PATH_PREFIX = "/wiki/"
+MEDIA_FRAGMENT_PREFIX = "/media/"
+
+KIND_PAGE = "page"
+KIND_SECTION = "section"
+KIND_IMAGE = "image"
+KIND_SPECIAL = "special"
+KIND_ENTITY = "entity"
+KIND_DEFINITION = "definition"
+
+
+class WikiLink(NamedTuple):
+    server: str
+    """The wiki's canonical host name, e.g. ``en.wikipedia.org``."""
+    title: str
+    """The unquoted page title, image name for ``image`` links, or entity id
+    for ``entity`` links."""
+    kind: str
+    """What to look up: ``page``, ``section``, ``image``, ``entity``,
+    ``definition``, or ``special`` (nothing)."""
+    fragment: str = ""
+    """The unquoted section anchor for ``section`` links."""
+
+
+@functools.lru_cache(maxsize=256)
+def _host(host: str) -> Optional[Tuple[str, FrozenSet[str]]]:
+    # the canonical host and every capability of a linked wiki, worked out
+    # once per host rather than one capability at a time for every new link
+    site = projects.lookup(host)
+    return (site.host, site.capabilities) if site is not None else None
+
+
+def _unquote(text: str) -> str:
+    # unquote() takes a while to find out there's nothing to do
+    return unquote(text) if "%" in text else text
+
+
+@functools.lru_cache(maxsize=256)
+def resolve_url(url: str) -> WikiLink:
+    """Work out what a link matching :data:`URL_PATTERN` points to.
+
+    What can be looked up depends on the capabilities of the linked wiki; see
+    :mod:`sopel_wikimedia.projects`. Results are memoized, since the same few
+    links tend to get pasted over and over again.
+
+    :raise ValueError: if ``url`` is not a link to a page on a known wiki
+    """
+    parts = urlsplit(url)
+    found = _host(parts.netloc)
+    if found is None or not parts.path.startswith(WIKI_PATH_PREFIX):
+        raise ValueError("Not a Wikimedia page link: {!r}".format(url))
+
+    server, capabilities = found
+    article = _unquote(parts.path)[len(WIKI_PATH_PREFIX):]
+    section = _unquote(parts.fragment)
+
+    if article.startswith("Special:"):
+        # The MediaWiki query API does not include pages in the Special:
+        # namespace, so there's no point bothering when we know this will error
+        return WikiLink(server, article, KIND_SPECIAL)
+
+    if article.startswith("File:"):
+        if projects.CAP_FILES in capabilities:
+            return WikiLink(server, article, KIND_IMAGE)
+        return WikiLink(server, article, KIND_SPECIAL)
+
+    if projects.CAP_ENTITIES in capabilities:
+        entity = R_ENTITY_TITLE.match(article)
+        if entity is None:
+            return WikiLink(server, article, KIND_SPECIAL)
+        return WikiLink(server, entity.group(1), KIND_ENTITY)
+
+    if section.startswith("/media"):
+        # gh2316: media fragments are usually images; try to get an image description
+        return WikiLink(server, section[len(MEDIA_FRAGMENT_PREFIX):], KIND_IMAGE)
+
+    if projects.CAP_DEFINITIONS in capabilities and not section:
+        return WikiLink(server, article, KIND_DEFINITION)
+
+    if section and not section.startswith("cite_note-") and projects.CAP_SECTIONS in capabilities:
+        return WikiLink(server, article, KIND_SECTION, section)
+
+    if projects.CAP_EXTRACTS in capabilities:
+        # Don't bother trying to retrieve a section snippet if cite-note is linked
+        return WikiLink(server, article, KIND_PAGE)
+
+    return WikiLink(server, article, KIND_SPECIAL)
@@ -0,0 +1,65 @@
+"""Tracking of frequently linked articles, to keep their snippets cached."""
+
+from __future__ import annotations
+
+import heapq
+import threading
+from typing import Dict, Hashable, List, Tuple
+
+
+class HotSet:
+    """Approximate counts of the most frequently seen keys.
+
+    Uses the Space-Saving algorithm: at most ``capacity`` keys are tracked, and
+    a new key replaces the least frequent one, inheriting its count. Keys seen
+    often enough are guaranteed to be tracked, so the top of the set is
+    reliable while memory use stays fixed.
+    """
+
+    def __init__(self, capacity: int = 200):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._counts: Dict[Hashable, float] = {}
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def add(self, key: Hashable) -> None:
+        if self.capacity <= 0:
+            return
+
+        with self._lock:
+            counts = self._counts
+            if key in counts:
+                counts[key] += 1
+            elif len(counts) < self.capacity:
+                counts[key] = 1
+            else:
+                victim = min(counts, key=counts.__getitem__)
+                counts[key] = counts.pop(victim) + 1
+
+    def top(self, number: int, minimum: float = 2) -> List[Tuple[Hashable, float]]:
+        """Get up to ``number`` of the most frequent keys, with their counts.
+
+        Keys seen fewer than ``minimum`` times are left out.
+        """
+        with self._lock:
+            items = list(self._counts.items())
+        return [
+            (key, count)
+            for key, count in heapq.nlargest(number, items, key=lambda item: item[1])
+            if count >= minimum
+        ]
+
+    def decay(self, factor: float = 0.5) -> None:
+        """Scale all counts down, so that old popularity fades away."""
+        with self._lock:
+            self._counts = {
+                key: count * factor
+                for key, count in self._counts.items()
+                if count * factor >= 0.5
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._counts.clear()
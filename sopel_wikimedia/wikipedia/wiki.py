@@ -1,16 +1,96 @@
 import logging
-from urllib.parse import quote
+from urllib.parse import quote, unquote
 
-import requests
+from sopel_wikimedia import cache, client, metrics, projects
 
-from sopel_wikimedia import WIKI_REQUEST_HEADERS
-from .parser import WikiParser
+from .extract import HTMLParserExtractor, get_extractor
 
 LOGGER = logging.getLogger(__name__)
 
+MAX_BATCH_TITLES = 20
+"""How many pages TextExtracts will return intro extracts for in one query."""
 
-def mw_image_description(server, image):
-    """Retrieves the description for the given image."""
+MAX_SNIPPET_CHARS = 1200
+"""Longest intro extract TextExtracts will return."""
+
+extractor = get_extractor()
+"""Engine used to extract text from section and image description HTML."""
+
+snippet_chars = 500
+"""Characters of intro text to request for snippets.
+
+The wikipedia plugin sizes this from how much of a snippet fits into a
+message, so that no more text is downloaded than can be shown.
+"""
+
+SECTION_INDEX_RECHECK_AGE = 60.0
+"""Seconds after which a cached section index missing a linked section is
+fetched again, in case the section was added (or renamed) since."""
+
+MISSING_ERRORS = frozenset(["missingtitle", "no-such-entity"])
+"""API error codes meaning that the requested page or entity doesn't exist."""
+
+
+class APIError(Exception):
+    """The MediaWiki API answered with an error, e.g. ``maxlag``.
+
+    Unlike a missing page, this says nothing about the page, so it must not be
+    cached as a negative result.
+    """
+
+    def __init__(self, code, info):
+        super().__init__("{}: {}".format(code, info))
+        self.code = code
+
+
+def get_api_json(url, missing=MISSING_ERRORS):
+    """Fetch and decode a MediaWiki API response.
+
+    :param missing: error codes to treat as "no such page"
+    :return: the decoded response, or ``None`` for an error in ``missing``
+    :raise APIError: for any other error
+    """
+    data = client.get_json(url)
+    error = data.get("error")
+    if error is None:
+        return data
+    if error.get("code") in missing:
+        return None
+    raise APIError(error.get("code"), error.get("info"))
+
+
+def configure(settings):
+    """Select the HTML extraction engine from the ``[wikipedia]`` config section."""
+    global extractor
+
+    try:
+        extractor = get_extractor(settings.html_engine)
+    except ImportError:
+        LOGGER.warning(
+            "HTML engine %r is not available, falling back to %r",
+            settings.html_engine,
+            HTMLParserExtractor.name,
+        )
+        extractor = HTMLParserExtractor()
+
+
+def mw_image_description(server, image, budget=None):
+    """Retrieves the description for the given image.
+
+    If ``budget`` is given, only about that many characters of the description
+    are extracted.
+    """
+    return cache.cached(
+        "image",
+        server,
+        image,
+        lambda: _fetch_image_description(server, image, budget),
+        section=budget,
+    )
+
+
+@metrics.timed("mw_image_description")
+def _fetch_image_description(server, image, budget):
     params = "&".join(
         [
             "action=query",
@@ -23,12 +103,13 @@ def mw_image_description(server, image):
             "titles={image}".format(image=image),
         ]
     )
-    url = "https://{server}/w/api.php?{params}".format(
-        server=server, params=params
+    url = "{api}?{params}".format(
+        api=projects.api_url(server), params=params
     )
 
-    response = requests.get(url, headers=WIKI_REQUEST_HEADERS)
-    json = response.json()
+    json = get_api_json(url)
+    if json is None:
+        return None
 
     try:
         query_data = json["query"]
@@ -50,12 +131,12 @@ def mw_image_description(server, image):
         return None
 
     # Some descriptions contain markup, use WikiParser to discard that
-    parser = WikiParser(image)
-    parser.feed(raw_desc)
-    desc = parser.get_result()
-    desc = " ".join(desc.split())  # collapse multiple whitespace chars
+    return _extract(raw_desc, image, budget)
 
-    return desc
+
+def normalize_query(query):
+    """Collapse whitespace in a search query, so equivalent queries share results."""
+    return " ".join(query.split())
 
 
 def mw_search(server, query, num):
@@ -64,74 +145,378 @@ def mw_search(server, query, num):
     Searches the specified MediaWiki server for the given query, and returns
     the specified number of results.
     """
+    query = normalize_query(query)
+    return cache.cached(
+        "search",
+        server,
+        query,
+        lambda: _fetch_search(server, query, num),
+        section=num,
+    )
+
+
+@metrics.timed("mw_search")
+def _fetch_search(server, query, num):
     search_url = (
-        "https://%s/w/api.php?format=json&action=query"
+        "%s?format=json&action=query"
         "&list=search&srlimit=%d&srprop=timestamp&srwhat=text"
         "&srsearch="
-    ) % (server, num)
-    search_url += query
-    query = requests.get(search_url, headers=WIKI_REQUEST_HEADERS).json()
-    if "query" in query:
+    ) % (projects.api_url(server), num)
+    search_url += quote(query)
+    query = get_api_json(search_url)
+    if query is not None and "query" in query:
         query = query["query"]["search"]
         return [r["title"] for r in query]
     return None
 
 
+def mw_search_snippet(server, query):
+    """Search a MediaWiki site, and fetch the top result's snippet along the way.
+
+    Returns the title of the top result, or ``None`` if there is none. Results
+    are cached like those of :func:`mw_search` with ``num=1``, and the
+    result's snippet is cached for :func:`mw_snippet`, so that a search costs
+    at most one request for both.
+    """
+    query = normalize_query(query)
+    titles = cache.cached(
+        "search",
+        server,
+        query,
+        lambda: _fetch_search_snippet(server, query),
+        section=1,
+    )
+    return titles[0] if titles else None
+
+
+@metrics.timed("mw_search_snippet")
+def _fetch_search_snippet(server, query):
+    search_url = (
+        "%s?format=json&action=query"
+        "&generator=search&gsrlimit=1&gsrwhat=text&gsrsearch=%s"
+        "&prop=extracts&exintro&explaintext&exchars=%d&redirects"
+    ) % (projects.api_url(server), quote(query), snippet_chars)
+    data = get_api_json(search_url) or {}
+    pages = data.get("query", {}).get("pages", {})
+    if not pages:
+        return None
+
+    page = min(pages.values(), key=lambda page: page.get("index", 0))
+    if "extract" in page:
+        cache.get_cache().set(cache.make_key("snippet", server, page["title"]), page["extract"])
+    return [page["title"]]
+
+
 def mw_snippet(server, query):
-    """Retrieves a snippet of the given page from the given MediaWiki server."""
+    """Retrieves a snippet of the given page from the given MediaWiki server.
+
+    Raises :exc:`KeyError` if the page doesn't exist.
+    """
+    snippet = cache.cached(
+        "snippet",
+        server,
+        query,
+        lambda: _fetch_snippet(server, query),
+    )
+    if snippet is None:
+        raise KeyError(query)
+    return snippet
+
+
+@metrics.timed("mw_snippet")
+def _fetch_snippet(server, query):
     snippet_url = (
-        "https://" + server + "/w/api.php?format=json"
+        projects.api_url(server) + "?format=json"
         "&action=query&prop=extracts&exintro&explaintext"
-        "&exchars=500&redirects&titles="
-    )
+        "&exchars=%d&redirects&titles="
+    ) % snippet_chars
     snippet_url += query
-    snippet = requests.get(snippet_url, headers=WIKI_REQUEST_HEADERS).json()
+    snippet = get_api_json(snippet_url)
+    if snippet is None:
+        return None
     snippet = snippet["query"]["pages"]
 
     # For some reason, the API gives the page *number* as the key, so we just
     # grab the first page number in the results.
     snippet = snippet[list(snippet.keys())[0]]
 
-    return snippet["extract"]
+    return snippet.get("extract")
 
 
-def mw_section(server, query, section):
+def mw_snippets(server, queries, refresh=False):
+    """Retrieves snippets of several pages from the given MediaWiki server.
+
+    Titles not already cached (or all of them, if ``refresh`` is true) are
+    requested in batches, so any number of pages costs one request per
+    :data:`MAX_BATCH_TITLES` titles. Returns a dict mapping each of ``queries``
+    to its snippet, or to ``None`` if the page doesn't exist.
+    """
+    return cache.cached_many(
+        "snippet",
+        server,
+        queries,
+        lambda missing: _fetch_snippet_batches(server, missing),
+        refresh=refresh,
+    )
+
+
+def cached_snippet(server, query):
+    """Get a snippet from the cache, without waiting for a request.
+
+    Recently expired snippets are returned too, and refreshed in the
+    background, as by :func:`mw_snippets`.
+
+    :return: a ``(found, snippet)`` tuple; ``snippet`` is ``None`` if the page
+             is known not to exist
+    """
+    state, _snippet = cache.get_cache().lookup(cache.make_key("snippet", server, query), count=False)
+    if state == cache.MISS:
+        return False, None
+    return True, mw_snippets(server, [query])[query]
+
+
+def _fetch_snippet_batches(server, queries):
+    results = {}
+    for start in range(0, len(queries), MAX_BATCH_TITLES):
+        results.update(_fetch_snippets(server, queries[start:start + MAX_BATCH_TITLES]))
+    return results
+
+
+@metrics.timed("mw_snippets")
+def _fetch_snippets(server, queries):
+    snippet_url = (
+        projects.api_url(server) + "?format=json"
+        "&action=query&prop=extracts&exintro&explaintext"
+        "&exchars=%d&exlimit=max&redirects&titles="
+    ) % snippet_chars
+    snippet_url += "|".join(queries)
+    data = (get_api_json(snippet_url) or {}).get("query", {})
+
+    # Follow the API's title normalization and redirects to find out which
+    # page ended up answering each of the requested titles.
+    renames = {}
+    for entry in data.get("normalized", []) + data.get("redirects", []):
+        renames[entry["from"]] = entry["to"]
+
+    extracts = {
+        page["title"]: page.get("extract")
+        for page in data.get("pages", {}).values()
+    }
+
+    results = {}
+    for query in queries:
+        title = unquote(query)
+        seen = {title}
+        while title in renames and renames[title] not in seen:
+            title = renames[title]
+            seen.add(title)
+        results[query] = extracts.get(title)
+
+    return results
+
+
+def mw_entity(server, entity, lang):
+    """Retrieves the label and description of a Wikibase entity, e.g. ``Q42``.
+
+    Both are in ``lang`` if possible, or in a fallback language otherwise.
+    Returns ``None`` if the entity doesn't exist or has no label.
+    """
+    return cache.cached(
+        "entity",
+        server,
+        entity,
+        lambda: _fetch_entity(server, entity, lang),
+        section=lang,
+    )
+
+
+@metrics.timed("mw_entity")
+def _fetch_entity(server, entity, lang):
+    entity_url = (
+        "{0}?format=json&action=wbgetentities&props=labels|descriptions"
+        "&languagefallback=1&languages={1}&ids={2}"
+    ).format(projects.api_url(server), quote(lang), quote(entity))
+    data = (get_api_json(entity_url) or {}).get("entities", {}).get(entity, {})
+
+    label = data.get("labels", {}).get(lang)
+    if label is None:
+        return None
+
+    description = data.get("descriptions", {}).get(lang)
+    if description is None:
+        return label["value"]
+    return "{} — {}".format(label["value"], description["value"])
+
+
+def mw_section(server, query, section, budget=None):
     """
     Retrieves a snippet from the specified section from the given page
     on the given server.
+
+    If ``budget`` is given, parsing stops once about that many characters of
+    the section's text have been extracted.
+    """
+    return cache.cached(
+        "section",
+        server,
+        query,
+        lambda: _fetch_section(server, query, section, budget),
+        section=(section, budget),
+    )
+
+
+class SectionIndex:
+    """Lookup table from section anchors to what is needed to fetch them.
+
+    Built from ``action=parse&prop=sections`` for one revision of a page, and
+    cached so that later section links to the same page only need a single
+    request for the section's text.
     """
+
+    __slots__ = ("title", "revid", "sections")
+
+    def __init__(self, title, revid, sections):
+        self.title = title
+        self.revid = revid
+        self.sections = sections
+        """Maps each anchor to its ``(index, fromtitle, line)``."""
+
+    def __contains__(self, anchor):
+        return anchor in self.sections
+
+    def __len__(self):
+        return len(self.sections)
+
+    def find(self, anchor):
+        """Get the ``(index, fromtitle, line)`` of a section, or ``None``."""
+        return self.sections.get(anchor)
+
+    def to_json(self):
+        return {"title": self.title, "revid": self.revid, "sections": self.sections}
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(
+            data["title"],
+            data["revid"],
+            {anchor: tuple(entry) for anchor, entry in data["sections"].items()},
+        )
+
+
+def mw_section_index(server, query, refresh=False):
+    """Retrieves the (cached) section index of the given page.
+
+    Returns ``None`` if the page does not exist.
+    """
+    key = cache.make_key("sections", server, query)
+    if refresh:
+        cache.get_cache().delete(key)
+
+    data = cache.cached(
+        "sections",
+        server,
+        query,
+        lambda: _fetch_section_index(server, query),
+    )
+    if data is None:
+        return None
+    return SectionIndex.from_json(data)
+
+
+def mw_find_section(server, query, section):
+    """Look up a section of the given page in its (cached) section index.
+
+    If the index doesn't have the section, it is fetched again, once, in case
+    the section is newer than the cached index; unless the index was cached
+    less than :data:`SECTION_INDEX_RECHECK_AGE` seconds ago.
+
+    Returns the section's ``(index, fromtitle, line)``, or ``None`` if the
+    page or the section does not exist.
+    """
+    index = mw_section_index(server, query)
+    if index is None:
+        return None
+
+    entry = index.find(section)
+    if entry is not None:
+        return entry
+
+    key = cache.make_key("sections", server, query)
+    remaining = cache.get_cache().remaining(key)
+    if remaining is not None and cache.get_cache().ttl("sections") - remaining < SECTION_INDEX_RECHECK_AGE:
+        return None
+
+    LOGGER.debug("No section %r in cached index for %r on %s; refreshing", section, query, server)
+    index = mw_section_index(server, query, refresh=True)
+    return index.find(section) if index is not None else None
+
+
+@metrics.timed("mw_section_index")
+def _fetch_section_index(server, query):
     sections_url = (
-        "https://{0}/w/api.php?format=json&redirects"
-        "&action=parse&prop=sections&page={1}".format(server, query)
+        "{0}?format=json&redirects"
+        "&action=parse&prop=sections|revid&page={1}".format(projects.api_url(server), query)
     )
-    sections = requests.get(sections_url, headers=WIKI_REQUEST_HEADERS).json()
+    data = get_api_json(sections_url)
 
-    fetch_title = section_number = None
+    if data is None:
+        LOGGER.debug("No sections for %r on %s: no such page", query, server)
+        return None
+
+    sections = {}
+    for entry in data["parse"]["sections"]:
+        # Needed to handle sections from transcluded pages properly
+        # e.g. template documentation (usually pulled in from /doc subpage).
+        # One might expect this prop to be nullable because in most cases it
+        # will simply repeat the requested page title, but it's always set.
+        fromtitle = entry.get("fromtitle")
+        if fromtitle is None:
+            continue
+        # the first of several identical anchors wins, as in the browser
+        sections.setdefault(entry["anchor"], (entry["index"], fromtitle, entry["line"]))
 
-    for entry in sections["parse"]["sections"]:
-        if entry["anchor"] == section:
-            section_number = entry["index"]
-            # Needed to handle sections from transcluded pages properly
-            # e.g. template documentation (usually pulled in from /doc subpage).
-            # One might expect this prop to be nullable because in most cases it
-            # will simply repeat the requested page title, but it's always set.
-            fetch_title = entry.get("fromtitle")
-            break
+    return SectionIndex(
+        data["parse"]["title"], data["parse"].get("revid"), sections
+    ).to_json()
 
-    if section_number is None or fetch_title is None:
+
+@metrics.timed("mw_section")
+def _fetch_section(server, query, section, budget):
+    entry = mw_find_section(server, query, section)
+    if entry is None:
         return None
 
-    snippet_url = (
-        "https://{0}/w/api.php?format=json&redirects"
-        "&action=parse&page={1}&prop=text"
-        "&section={2}"
-    ).format(server, quote(fetch_title), section_number)
+    data = _fetch_section_text(server, entry)
+
+    # The index may be from an older revision of the page, whose section
+    # number no longer exists or now belongs to another section; the returned
+    # section list starts with the requested section, so make sure it is
+    # still the one we wanted before trusting the result.
+    fetched = (data["parse"].get("sections") or []) if data is not None else []
+    if data is None or (fetched and fetched[0]["anchor"] != section):
+        LOGGER.debug("Stale section index for %r on %s", query, server)
+        index = mw_section_index(server, query, refresh=True)
+        entry = index.find(section) if index is not None else None
+        if entry is None:
+            return None
+        data = _fetch_section_text(server, entry)
+        if data is None:
+            return None
+
+    return _extract(data["parse"]["text"]["*"], section.replace("_", " "), budget)
+
 
-    data = requests.get(snippet_url, headers=WIKI_REQUEST_HEADERS).json()
+def _extract(html, section_name, budget):
+    with metrics.timer("parse", engine=extractor.name):
+        return extractor.extract(html, section_name, budget)
 
-    parser = WikiParser(section.replace("_", " "))
-    parser.feed(data["parse"]["text"]["*"])
-    text = parser.get_result()
-    text = " ".join(text.split())  # collapse multiple whitespace chars
 
-    return text
+def _fetch_section_text(server, entry):
+    section_number, fetch_title, _line = entry
+    snippet_url = (
+        "{0}?format=json&redirects"
+        "&action=parse&page={1}&prop=text|sections"
+        "&section={2}"
+    ).format(projects.api_url(server), quote(fetch_title), section_number)
+
+    return get_api_json(snippet_url, MISSING_ERRORS | {"nosuchsection"})
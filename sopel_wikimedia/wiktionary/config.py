@@ -0,0 +1,17 @@
+"""Configuration section for plugin."""
+
+from __future__ import annotations
+
+from sopel.config import types
+
+
+class WiktionarySection(types.StaticSection):
+    backend = types.ChoiceAttribute("backend", choices=["index", "parse"], default="index")
+    """How entries are fetched.
+
+    ``index`` scrapes the whole rendered page; ``parse`` asks the MediaWiki
+    parse API for only the English section, which is a much smaller download.
+
+    Shared settings, such as connection pooling and caching, are read from the
+    ``[wikipedia]`` section.
+    """
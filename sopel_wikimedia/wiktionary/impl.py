@@ -1,12 +1,12 @@
 from __future__ import annotations
 
 import re
-from typing import Dict, List, Optional
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
-import requests
 from sopel.tools import web
 
-from sopel_wikimedia import WIKI_REQUEST_HEADERS
+from sopel_wikimedia import cache, client, metrics, projects
+from sopel_wikimedia.wikipedia.wiki import get_api_json, mw_section_index
 
 # From https://en.wiktionary.org/wiki/Wiktionary:Entry_layout#Part_of_speech
 PARTS_OF_SPEECH = [
@@ -61,14 +61,40 @@ PARTS_OF_SPEECH = [
     "Romanization",
 ]
 PARTS_OF_SPEECH_LOWER = [pos.lower() for pos in PARTS_OF_SPEECH]
+PARTS_OF_SPEECH_BY_ID = {pos.replace(" ", "_"): pos.lower() for pos in PARTS_OF_SPEECH}
+R_HEADING_ID = re.compile(
+    r'id="(?:(?P<etymology>Etymology)|(?P<pos>{})")'.format(
+        "|".join(re.escape(pos_id) for pos_id in PARTS_OF_SPEECH_BY_ID)
+    )
+)
+"""Matches the ids of etymology and part-of-speech headings in one pass."""
+
+SERVER = projects.site("wiktionary", "en").host
+"""The Wiktionary whose entries the commands look up."""
+URI = "%s?title=%s&printable=yes"
+PARSE_URI = "%s?format=json&redirects&action=parse&prop=text&page=%s&section=%s"
+LANGUAGE = "English"
+"""Language section to take definitions from when using the parse backend."""
+
+backend = "index"
+"""How :func:`wikt` fetches entries.
 
-URI = "https://en.wiktionary.org/w/index.php?title=%s&printable=yes"
+``index`` scrapes the rendered page from ``index.php``; ``parse`` asks the
+MediaWiki parse API for just the :data:`LANGUAGE` section.
+"""
 R_SUP = re.compile(r"<sup[^>]+>.+?</sup>")  # Superscripts that are references only, not ordinal indicators, etc...
 R_TAG = re.compile(r"<[^>]+>")
 R_UL = re.compile(r"(?ims)<ul>.*?</ul>")
+R_UL_START = re.compile(r"(?i)<ul>")
+R_UL_END = re.compile(r"(?i)</ul>")
 
 Etymology = Optional[str]
 Definitions = Dict[str, List[str]]
+Lines = Tuple[str, ...]
+
+ENTRY_FORMAT = 2
+"""Version of the cached entry format; part of the cache key, so that entries
+cached in an older format are never read back."""
 
 
 def text(html: str) -> str:
@@ -83,60 +109,207 @@ def text(html: str) -> str:
     return text.strip()
 
 
-def wikt(word: str) -> tuple[Etymology, Definitions]:
+class WiktEntry:
+    """The first language section of a Wiktionary entry.
+
+    Holds the raw HTML lines of the etymology and of each part of speech's
+    definitions; they are only cleaned up with :func:`text` when read, so
+    definitions that never get shown cost nothing.
+    """
+
+    __slots__ = ("etymology_lines", "parts")
+
+    def __init__(self, etymology_lines: Lines = (), parts: Tuple[Tuple[str, Lines], ...] = ()):
+        self.etymology_lines = etymology_lines
+        self.parts = parts
+        """``(part of speech, definition lines)`` pairs, in the order of
+        :data:`PARTS_OF_SPEECH`."""
+
+    def __bool__(self) -> bool:
+        return bool(self.etymology_lines or self.parts)
+
+    @property
+    def etymology(self) -> Etymology:
+        if not self.etymology_lines:
+            return None
+        # multi-line etymologies do exist (e.g. see "mayhem")
+        return " ".join(text(line) for line in self.etymology_lines)
+
+    def definitions(self) -> Definitions:
+        """Get every definition, cleaned up, by part of speech."""
+        return {part: [text(line) for line in lines] for part, lines in self.parts}
+
+    def to_json(self):
+        return [list(self.etymology_lines), [[part, list(lines)] for part, lines in self.parts]]
+
+    @classmethod
+    def from_json(cls, data):
+        etymology_lines, parts = data
+        return cls(tuple(etymology_lines), tuple((part, tuple(lines)) for part, lines in parts))
+
+
+def wikt(word: str, server: str = SERVER) -> WiktEntry:
     """
     Retrieve the Wiktionary entry
+
+    Entries can only be parsed from wikis with the
+    :data:`~sopel_wikimedia.projects.CAP_DEFINITIONS` capability.
     """
-    response = requests.get(
-        URI % web.quote(word),
-        headers=WIKI_REQUEST_HEADERS,
-    )
-    response.raise_for_status()
-    txt = response.text
-    txt = R_UL.sub("", txt)
+    fetch = _fetch_wikt_section if backend == "parse" else _fetch_wikt
+
+    def load():
+        # with the index backend, parsing is part of this, since the page is
+        # parsed while it is downloaded
+        with metrics.timer("fetch", host=server, operation="wikt"):
+            entry = fetch(server, word)
+        # an entry with nothing in it is cached as a negative result
+        return entry.to_json() if entry else None
+
+    data = cache.cached("wiktionary", server, word, load, section=ENTRY_FORMAT)
+    if data is None:
+        return WiktEntry()
+    return WiktEntry.from_json(data)
+
+
+def _fetch_wikt(server: str, word: str) -> WiktEntry:
+    # Entries for common words can be huge, but only the first language
+    # section is of interest; stream the page so we can hang up at its end.
+    with client.get(URI % (projects.index_url(server), web.quote(word)), stream=True) as response:
+        if response.status_code == 404:
+            # no such entry; this is cached as a negative result
+            return WiktEntry()
+        response.raise_for_status()
+        if response.encoding is None:
+            response.encoding = "utf-8"
+        return parse_entry(strip_lists(response.iter_lines(decode_unicode=True)))
+
+
+def _fetch_wikt_section(server: str, word: str) -> WiktEntry:
+    # The section index is cached, so this is usually a single request for
+    # only the HTML of the language section we want.
+    index = mw_section_index(server, web.quote(word))
+    entry = index.find(LANGUAGE) if index is not None else None
+    if entry is None:
+        return WiktEntry()
+
+    section_number, fetch_title, _line = entry
+    data = get_api_json(PARSE_URI % (projects.api_url(server), web.quote(fetch_title), section_number))
+    if data is None:
+        return WiktEntry()
 
+    html = data["parse"]["text"]["*"]
+    with metrics.timer("parse", engine="wiktionary"):
+        return parse_entry(strip_lists(html.splitlines()))
+
+
+def strip_lists(lines: Iterable[str]) -> Iterator[str]:
+    """Remove ``<ul>`` lists from HTML as it is read, line by line.
+
+    Equivalent to applying :data:`R_UL` to the whole document and splitting it
+    into lines afterwards, without having to hold the whole document: the text
+    before a list that spans several lines is joined to the text after it.
+    """
+    pending = None
+    for line in lines:
+        if pending is not None:
+            end = R_UL_END.search(line)
+            if end is None:
+                continue
+            line = pending + line[end.end():]
+            pending = None
+
+        line = R_UL.sub("", line)
+        start = R_UL_START.search(line)
+        if start is not None:
+            pending = line[:start.start()]
+            continue
+
+        yield line
+
+
+def parse_entry(lines: Iterable[str]) -> WiktEntry:
+    """Parse the first language section of a Wiktionary entry's HTML lines.
+
+    Stops reading ``lines`` at the ``<hr`` that ends the section.
+    """
     mode = None
-    etymology = None
-    definitions = {}
-
-    for line in txt.splitlines():
-        is_new_mode = False
-        if 'id="Etymology' in line:
-            mode = "etymology"
-            is_new_mode = True
-        else:
-            for pos in PARTS_OF_SPEECH:
-                if 'id="{}"'.format(pos.replace(" ", "_")) in line:
-                    mode = pos.lower()
-                    is_new_mode = True
-                    break
-
-        if not is_new_mode:
-            if (mode == "etymology") and ("<p>" in line):
-                if etymology is not None:
-                    # multi-line etymologies do exist (e.g. see "mayhem")
-                    etymology += " " + text(line)
-                else:
-                    etymology = text(line)
-            # 'id="' can occur in definition lines <li> when <sup> tag is used for references;
-            # make sure those are not excluded (e.g. see "abecedarian").
-            elif ('id="' in line) and ("<li>" not in line):
-                mode = None
-            elif (mode is not None) and ("<li>" in line):
-                definitions.setdefault(mode, []).append(text(line))
+    etymology: List[str] = []
+    definitions: Dict[str, List[str]] = {}
+
+    for line in lines:
+        heading = R_HEADING_ID.search(line) if 'id="' in line else None
+        if heading is not None:
+            if heading.group("etymology"):
+                mode = "etymology"
+            else:
+                mode = PARTS_OF_SPEECH_BY_ID[heading.group("pos")]
+        elif (mode == "etymology") and ("<p>" in line):
+            etymology.append(line)
+        # 'id="' can occur in definition lines <li> when <sup> tag is used for references;
+        # make sure those are not excluded (e.g. see "abecedarian").
+        elif ('id="' in line) and ("<li>" not in line):
+            mode = None
+        elif (mode is not None) and ("<li>" in line):
+            definitions.setdefault(mode, []).append(line)
 
         if "<hr" in line:
             break
 
-    return etymology, definitions
+    return WiktEntry(
+        tuple(etymology),
+        tuple(
+            (part, tuple(definitions[part]))
+            for part in PARTS_OF_SPEECH_LOWER
+            if part in definitions
+        ),
+    )
+
+
+def configure(settings: Any) -> None:
+    """Select the backend from the ``[wiktionary]`` config section."""
+    global backend
+
+    backend = settings.backend
+
+
+def format_wikt(
+    result: str,
+    entry: WiktEntry,
+    number=2,
+    max_length: Optional[int] = None,
+    max_number=5,
+) -> str:
+    """Append the first ``number`` definitions of each part of speech to ``result``.
+
+    If ``max_length`` is given, up to ``max_number`` definitions of each part
+    of speech are shown instead, as many as fit into ``max_length`` bytes.
+    Definitions are added one rank at a time, each cleaned up and formatted
+    only once, and only if it is shown.
+    """
+    parts = [(" — {}: ".format(part), lines) for part, lines in entry.parts]
+    shown: List[List[str]] = [[] for _part in parts]
+    length = len(result.encode("utf-8")) + sum(len(heading.encode("utf-8")) for heading, _defs in parts)
+    limit = number if max_length is None else max(number, max_number)
+
+    for rank in range(limit):
+        added = {}
+        cost = 0
+        for index, (_heading, defs) in enumerate(parts):
+            if rank < len(defs):
+                item = "%s. %s" % (rank + 1, text(defs[rank]).strip(" ."))
+                added[index] = item
+                cost += len(item.encode("utf-8")) + (2 if rank else 0)  # ", " separator
+
+        if not added:
+            break
+        if max_length is not None and rank >= number and length + cost > max_length:
+            break
 
+        length += cost
+        for index, item in added.items():
+            shown[index].append(item)
 
-def format_wikt(result: str, definitions: Definitions, number=2) -> str:
-    for part in PARTS_OF_SPEECH_LOWER:
-        if part in definitions:
-            defs = definitions[part][:number]
-            result += " — {}: ".format(part)
-            n = ["%s. %s" % (i + 1, e.strip(" .")) for i, e in enumerate(defs)]
-            result += ", ".join(n)
+    for (heading, _defs), items in zip(parts, shown):
+        result += heading + ", ".join(items)
 
     return result.strip(" .,")
@@ -10,11 +10,32 @@ from __future__ import annotations
 
 from sopel import plugin
 
-from .impl import format_wikt, wikt
+from sopel_wikimedia import engine, irc, services, workers
+
+from . import impl
+from .config import WiktionarySection
+from .impl import SERVER, format_wikt
 
 PLUGIN_OUTPUT_PREFIX = "[wiktionary] "
 
 
+def setup(bot):
+    services.setup(bot)
+    bot.config.define_section("wiktionary", WiktionarySection)
+    impl.configure(bot.config.wiktionary)
+
+
+def shutdown(bot):
+    services.shutdown(bot)
+
+
+def configure(config):
+    config.define_section("wiktionary", WiktionarySection)
+    config.wiktionary.configure_setting(
+        "backend", "How should Wiktionary entries be fetched (index or parse)?"
+    )
+
+
 @plugin.command("wt", "define", "dict")
 @plugin.example(".wt bailiwick", "bailiwick — noun: 1. The district within which a bailie or bailiff has jurisdiction, 2. A person's concern or sphere of operations, their area of skill or authority")  # noqa
 @plugin.output_prefix(PLUGIN_OUTPUT_PREFIX)
@@ -25,19 +46,23 @@ def wiktionary(bot, trigger):
         bot.reply("You must tell me what to look up!")
         return
 
-    _etymology, definitions = wikt(word)
-    if not definitions:
+    future = workers.submit(trigger.sender, say_definitions, bot, trigger, word)
+    return irc.wait_for(bot, future, dropped=plugin.NOLIMIT)
+
+
+@irc.replies_on_error("Error looking up that word on Wiktionary.")
+def say_definitions(bot, trigger, word):
+    entry = engine.call("wikt", SERVER, word)
+    if not entry.parts:
         # Cast word to lower to check in case of mismatched user input
-        _etymology, definitions = wikt(word.lower())
-        if not definitions:
+        entry = engine.call("wikt", SERVER, word.lower())
+        if not entry.parts:
             bot.reply("Couldn't get any definitions for %s." % word)
             return
 
-    result = format_wikt(word, definitions)
-    if len(result) < 300:
-        result = format_wikt(word, definitions, 3)
-    if len(result) < 300:
-        result = format_wikt(word, definitions, 5)
+    # show more than two definitions of each part of speech if they fit
+    max_length = irc.text_length(bot, trigger.sender) - len(PLUGIN_OUTPUT_PREFIX)
+    result = format_wikt(word, entry, max_length=max_length)
 
     bot.say(result, truncation=" […]")
 
@@ -52,7 +77,13 @@ def wiktionary_ety(bot, trigger):
         bot.reply("You must give me a word!")
         return
 
-    etymology, _definitions = wikt(word)
+    future = workers.submit(trigger.sender, say_etymology, bot, trigger, word)
+    return irc.wait_for(bot, future, dropped=plugin.NOLIMIT)
+
+
+@irc.replies_on_error("Error looking up that word on Wiktionary.")
+def say_etymology(bot, trigger, word):
+    etymology = engine.call("wikt", SERVER, word).etymology
     if not etymology:
         bot.reply("Couldn't get the etymology for %s." % word)
         return
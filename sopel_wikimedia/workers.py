@@ -0,0 +1,234 @@
+"""Bounded worker pool for the plugins' lookups, with load shedding.
+
+Sopel runs every matching callable in a thread of its own, so a flood of links
+or a slow Wikimedia host would otherwise pile up threads all making requests.
+Instead, the plugins hand each lookup to this pool. The pool runs a fixed
+number of lookups at once, takes queued lookups from each channel in turn so
+that one busy channel can't hold up the others, and drops lookups that:
+
+* arrive while the queue (or the channel's share of it) is full, or
+* waited longer than the deadline, since an answer minutes late is just noise.
+
+Each submitted lookup gets a future. Command handlers wait on it, so that they
+can still return :data:`sopel.plugin.NOLIMIT`; link handlers don't need to.
+"""
+
+from __future__ import annotations
+
+import collections
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import (Any, Callable, Deque, Dict, List, NamedTuple, Optional,
+                    Tuple)
+
+from . import metrics
+
+LOGGER = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_QUEUE = 64
+DEFAULT_MAX_CHANNEL_QUEUE = 8
+DEFAULT_DEADLINE = 30.0
+
+
+class _Job(NamedTuple):
+    function: Callable[..., Any]
+    args: Tuple[Any, ...]
+    deadline: float
+    future: concurrent.futures.Future
+
+
+class WorkerPool:
+    """Run submitted functions on a fixed number of threads.
+
+    :param workers: how many functions may run at once
+    :param max_queue: how many functions may wait to run, in total
+    :param max_channel_queue: how many functions may wait to run for any one
+                              channel (or private conversation)
+    :param deadline: seconds after which a function still waiting is dropped
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_WORKERS,
+        max_queue: int = DEFAULT_MAX_QUEUE,
+        max_channel_queue: int = DEFAULT_MAX_CHANNEL_QUEUE,
+        deadline: float = DEFAULT_DEADLINE,
+    ):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.max_channel_queue = max_channel_queue
+        self.deadline = deadline
+
+        self._cond = threading.Condition()
+        self._queues: Dict[str, Deque[_Job]] = collections.OrderedDict()
+        self._threads: List[threading.Thread] = []
+        self._generation = 0
+        self.queued = 0
+        """How many functions are waiting to run."""
+        self.running = 0
+        self.completed = 0
+        self.shed_full = 0
+        """How many functions were dropped because the queue was full."""
+        self.shed_expired = 0
+        """How many functions were dropped because they waited too long."""
+
+    def _start(self) -> None:
+        # called with the condition held; threads of an earlier start exit
+        # when they see the generation has changed
+        self._generation += 1
+        self._threads = [
+            threading.Thread(
+                target=self._work,
+                args=(self._generation,),
+                name="sopel-wikimedia-worker-{}".format(number),
+                daemon=True,
+            )
+            for number in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(
+        self, channel: str, function: Callable[..., Any], *args
+    ) -> Optional[concurrent.futures.Future]:
+        """Queue ``function(*args)`` on behalf of ``channel``.
+
+        :return: a future for the function's result, or ``None`` if it was
+                 shed because the queue is full; the future is cancelled if
+                 the function is dropped later on
+        """
+        key = channel.lower()
+        with self._cond:
+            # while every worker is stuck on a slow host, nothing takes jobs
+            # off the queue; expired ones must not count against its limits
+            self._purge_expired()
+            queue = self._queues.get(key)
+            if self.queued >= self.max_queue or (
+                queue is not None and len(queue) >= self.max_channel_queue
+            ):
+                self.shed_full += 1
+                metrics.inc("lookups_shed_total", reason="full")
+                return None
+
+            if not self._threads:
+                self._start()
+
+            if queue is None:
+                queue = self._queues[key] = collections.deque()
+            future: concurrent.futures.Future = concurrent.futures.Future()
+            queue.append(_Job(function, args, time.monotonic() + self.deadline, future))
+            self.queued += 1
+            self._cond.notify()
+        return future
+
+    def _shed_expired(self, job: _Job) -> None:
+        # called with the condition held
+        self.shed_expired += 1
+        metrics.inc("lookups_shed_total", reason="expired")
+        LOGGER.debug("Dropping lookup that waited too long: %r", job.function)
+        job.future.cancel()
+
+    def _purge_expired(self) -> None:
+        # called with the condition held; each channel's jobs are queued in
+        # the order of their deadlines, so only the oldest need checking
+        now = time.monotonic()
+        for key, queue in list(self._queues.items()):
+            while queue and now > queue[0].deadline:
+                self._shed_expired(queue.popleft())
+                self.queued -= 1
+            if not queue:
+                del self._queues[key]
+
+    def _next(self) -> _Job:
+        # called with the condition held and something queued; take the next
+        # job of the channel that has waited longest for a turn
+        key, queue = next(iter(self._queues.items()))
+        job = queue.popleft()
+        del self._queues[key]
+        if queue:
+            self._queues[key] = queue
+        self.queued -= 1
+        return job
+
+    def _work(self, generation: int) -> None:
+        while True:
+            with self._cond:
+                while not self._queues and generation == self._generation:
+                    self._cond.wait()
+                if generation != self._generation:
+                    return
+
+                job = self._next()
+                if time.monotonic() > job.deadline:
+                    self._shed_expired(job)
+                    continue
+                if not job.future.set_running_or_notify_cancel():
+                    continue
+                self.running += 1
+
+            try:
+                job.future.set_result(job.function(*job.args))
+            except Exception as exc:
+                LOGGER.exception("Error in Wikimedia lookup")
+                job.future.set_exception(exc)
+            finally:
+                with self._cond:
+                    self.running -= 1
+                    self.completed += 1
+
+    def stop(self) -> None:
+        """Drop every queued function and let the worker threads exit.
+
+        Functions already running are left to finish on their own.
+        """
+        with self._cond:
+            self._generation += 1
+            for queue in self._queues.values():
+                for job in queue:
+                    job.future.cancel()
+            self._queues.clear()
+            self.queued = 0
+            self._threads = []
+            self._cond.notify_all()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {
+                "queued": self.queued,
+                "running": self.running,
+                "completed": self.completed,
+                "shed_full": self.shed_full,
+                "shed_expired": self.shed_expired,
+            }
+
+
+_pool = WorkerPool()
+
+
+def get_pool() -> WorkerPool:
+    """Get the shared pool."""
+    return _pool
+
+
+def submit(channel: str, function: Callable[..., Any], *args) -> Optional[concurrent.futures.Future]:
+    """Queue a function on the shared pool; see :meth:`WorkerPool.submit`."""
+    return _pool.submit(channel, function, *args)
+
+
+def configure(settings: Any) -> None:
+    """Configure the shared pool from the ``[wikipedia]`` config section.
+
+    The number of workers takes effect the next time the pool starts.
+    """
+    _pool.workers = settings.lookup_workers
+    _pool.max_queue = settings.lookup_queue_size
+    _pool.max_channel_queue = settings.lookup_channel_queue_size
+    _pool.deadline = settings.lookup_deadline
+
+
+def close() -> None:
+    """Stop the shared pool."""
+    _pool.stop()